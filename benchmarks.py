@@ -0,0 +1,80 @@
+# vim: set fileencoding=utf-8 :
+#
+# benchmarks -- per-call timings for the hot paths, before and after
+#
+#   python benchmarks.py [name ...]
+#
+import sys
+import timeit
+import itertools
+import unicodedata
+from wrchartools import makeutf8, anglicize, displaywidth
+
+def _per_call(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3))/number
+
+def _report(title, cases, before, after, number):
+    print "%-36s %10s %10s" % (title, "before", "after")
+    for name, value in cases:
+        b = _per_call(lambda: before(value), number)*1e6
+        a = _per_call(lambda: after(value), number)*1e6
+        print "  %-34s %8.2fus %8.2fus  x%.1f" % (name, b, a, b/a)
+    print
+
+def _old_anglicize(text, charsets=[], encode_errors='ignore'):
+    # -- What anglicize used to do: round trip through makeUTF8, then translate/normalize/encode
+    temp = unicode(makeutf8.makeUTF8(text, charsets=charsets), 'utf-8')
+    return anglicize._normalize(temp, encode_errors)
+
+ANGLICIZE_CASES = [("ascii str", "Campaign Name 1234 - PartnersDec172012NewsletterBase"),
+                   ("ascii unicode", u"Campaign Name 1234 - PartnersDec172012NewsletterBase"),
+                   ("utf-8 str", "Qu\xc3\xa9bec \xe2\x80\x93 Caf\xc3\xa9 \xe2\x80\x9cM\xc3\xbcnchen\xe2\x80\x9d"),
+                   ("cp1252 str", "Qu\xe9bec \x96 Caf\xe9 \x93M\xfcnchen\x94 \x85"),
+                   ("unicode", u"Qu\xe9bec – Caf\xe9 “M\xfcnchen” …"),
+                   ]
+
+def bench_anglicize(number=20000):
+    _report("anglicize, per call", ANGLICIZE_CASES, _old_anglicize, anglicize.anglicize, number)
+
+def _naive_display_width(text):
+    # -- The obvious way: ask unicodedata about every character
+    width = 0
+    for c in text:
+        if unicodedata.category(c) in ('Mn', 'Me', 'Cf'):
+            continue
+        width += 2 if unicodedata.east_asian_width(c) in ('W', 'F') else 1
+    return width
+
+DISPLAY_WIDTH_CASES = [("ascii", u"PartnersDec172012NewsletterBase"),
+                       ("latin-1", u"Qu\xe9bec Caf\xe9 M\xfcnchen"),
+                       ("combining", u"Que\u0301bec Cafe\u0301 Mu\u0308nchen"),
+                       ("CJK", u"\u6771\u4eac\u90fd\u6e0b\u8c37\u533a\u5927\u962a"),
+                       ]
+
+def bench_display_width(number=50000):
+    displaywidth.display_width(u"\u6771")    # -- fill in the translate table outside the timings
+    _report("display width, per string", DISPLAY_WIDTH_CASES, _naive_display_width, displaywidth.display_width, number)
+    _report("column width, len() vs display", COLUMN_CASES, _len_column_width, _display_column_width, number/100)
+
+COLUMN_CASES = [("1000 ascii cells", [u"Campaign %s" % i for i in range(1000)]),
+                ("1000 cells, one CJK", [u"Campaign %s" % i for i in range(999)]+[DISPLAY_WIDTH_CASES[3][1]]),
+                ("1000 latin-1 cells", [u"Caf\xe9 %s" % i for i in range(1000)]),
+                ]
+
+def _len_column_width(col):
+    return max(itertools.imap(len, col))
+
+def _display_column_width(col):
+    # -- What printrows does for each column
+    widths = displaywidth.display_widths(col)
+    if widths is None:
+        return max(itertools.imap(len, col))
+    return max(widths)
+
+BENCHMARKS = [bench_anglicize, bench_display_width]
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    for bench in BENCHMARKS:
+        if not names or bench.__name__[len("bench_"):] in names:
+            bench()
@@ -22,5 +22,8 @@ setup(name='wrchartools',
       ],
       entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      wr-transcode = wrchartools.transcode:main
+      wr-anglicize = wrchartools.anglicize:main
       """,
       )
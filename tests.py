@@ -1,7 +1,20 @@
 # vim: set fileencoding=utf-8 :
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import threading
 import itertools
+import collections
+import StringIO
+import cStringIO
 import unittest
-from wrchartools import makeutf8, anglicize, stdwrapper, printrows
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from wrchartools import makeutf8, anglicize, stdwrapper, printrows, transcode, displaywidth
 
 CP1252_STR = "\x80\x80\x80\x80"
 UTF8_STR = "\xe2\x82\xac\xe2\x82\xac\xe2\x82\xac\xe2\x82\xac"
@@ -66,11 +79,149 @@ class makeutf8TestCase(unittest.TestCase):
             got =  makeutf8.makeUTF8(val, charsets, encode_errors)
             self.assertTrue(got==uexpected, "Input     %r\nGot:      %r\nExpected: %r" % (val, got, uexpected))
             
+    def test_sniff_charset(self):
+        _s = makeutf8.sniff_charset
+        self.assertEqual(_s("ascii-foo"), "utf-8")
+        self.assertEqual(_s(UTF8_STR), "utf-8")
+        self.assertEqual(_s(CP1252_STR), "cp1252")
+        self.assertEqual(_s("junk-aaa\x8e"), "cp1252")
+        self.assertEqual(_s("junk-aaa\x8f"), "mac_roman")
+        self.assertEqual(_s("Qu\x8er\x8e", ['mac_roman', 'cp1252']), "mac_roman")
+        self.assertEqual(_s("\x8f", ['cp1252']), None)
+        # Single byte charsets are settled from their byte tables, w/o decoding
+        self.assertEqual(makeutf8._charset_class('cp1252'), ('cp1252', '\x81\x8d\x8f\x90\x9d'))
+        self.assertEqual(makeutf8._charset_class('850'), ('cp850', ''))
+        self.assertEqual(makeutf8._charset_class('utf8'), ('utf-8', None))
+
+    def test_iter_unicode(self):
+        data = UTF8_STR + "utf8-\xc3\xa4\xc3\xb6\xc3\xbc" + UTF8_STR
+        for size in range(1, 6):
+            chunks = [data[i:i+size] for i in range(0, len(data), size)]
+            got = u"".join(makeutf8.iter_unicode(chunks))
+            self.assertEqual(got, unicode(data, 'utf-8'))
+
+        # Falls back to cp1252 part way through, w/o touching what was already decoded
+        decoder = makeutf8.IncrementalCharsetDecoder()
+        got = decoder.decode(UTF8_STR) + decoder.decode("caf\xe9 " + CP1252_STR) + decoder.decode("", True)
+        self.assertEqual(got, UNICODE_STR + u"caf\xe9 " + UNICODE_STR)
+        self.assertEqual(decoder.charset, 'cp1252')
+        self.assertEqual(decoder.fallbacks, 1)
+
+        # The chunk that won't decode also finishes a character split across chunks
+        self.assertEqual(list(makeutf8.iter_unicode(['abc\xe2\x82', '\xac caf\xe9 x'])),
+                         [u"abc", u"\u20ac caf\xe9 x"])
+
+        got = "".join(makeutf8.iterUTF8(StringIO.StringIO(CP1252_STR*3), chunk_size=5))
+        self.assertEqual(got, UTF8_STR*3)
+
+    def test_batch_converter(self):
+        bc = makeutf8.BatchConverter(sample_size=3)
+        items = ["ascii", CP1252_STR, "junk-aaa\x8e", CP1252_STR, None, "junk-aaa\x81", CP1252_STR]
+        got = list(bc.iterUTF8(items))
+        self.assertEqual(got, [makeutf8.makeUTF8(i) for i in items])
+        self.assertEqual(bc.charset, 'cp1252')
+        self.assertEqual(bc.fallbacks, 1)
+        self.assertEqual(bc.make_unicode(CP1252_STR), UNICODE_STR)
+        # -- utf-8 items after a single byte charset is learned aren't mojibaked
+        self.assertEqual(bc.make_unicode(UTF8_STR), UTF8_STR.decode('utf-8'))
+        self.assertEqual(bc.fallbacks, 2)
+
+    def test_decode_cache(self):
+        with makeutf8.DecodeCache(max_entries=2, max_bytes=20) as cache:
+            for val in [CP1252_STR, CP1252_STR, "junk-aaa\x8e", CP1252_STR, "Qu\x8er\x8e", "junk-aaa\x8e", "x"*21]:
+                self.assertEqual(makeutf8.makeUTF8(val), unicode(val, 'cp1252').encode('utf-8'))
+            self.assertEqual((cache.hits, cache.misses), (2, 5))
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.bytes, 14)
+            self.assertEqual(makeutf8.make_unicode("Qu\x8er\x8e", ['mac_roman']), u"Qu\xe9r\xe9")
+        self.assertEqual(makeutf8.makeUTF8(CP1252_STR), UTF8_STR)
+        self.assertEqual(cache.misses, 6)
+
+        # each thread's with block only covers that thread, however they overlap
+        entered = threading.Event()
+        exited = threading.Event()
+        def work():
+            with makeutf8.DecodeCache() as other:
+                entered.set()
+                exited.wait(5)
+                makeutf8.makeUTF8("junk-aaa\x8e")
+            results.append(other.misses)
+        results = []
+        thread = threading.Thread(target=work)
+        with makeutf8.DecodeCache() as cache:
+            thread.start()
+            entered.wait(5)
+        exited.set()
+        thread.join()
+        makeutf8.makeUTF8(CP1252_STR)
+        self.assertEqual((results, cache.misses), ([1], 0))
+
+    def test_repair_utf8(self):
+        mixed = "utf8-\xc3\xa4\xc3\xb6\xc3\xbc cp1252-1000\x80 " + UTF8_STR + " junk-aaa\x81"
+        self.assertEqual(makeutf8.repair_utf8(mixed),
+                         "utf8-\xc3\xa4\xc3\xb6\xc3\xbc cp1252-1000\xe2\x82\xac " + UTF8_STR + " junk-aaa\xc3\x85")
+        self.assertEqual(makeutf8.repair_utf8(UTF8_STR), UTF8_STR)
+        self.assertEqual(makeutf8.repair_utf8(UTF8_STR[:-1]), UTF8_STR[:-3] + "\xc3\xa2\xe2\x80\x9a")
+        self.assertEqual(makeutf8.repair_utf8(UNICODE_STR), UTF8_STR)
+
     def test_anglicize(self):
         for val, uexpected, aexpected, charsets, encode_errors in TEST_VALUES:
             got =  anglicize.anglicize(val, charsets=charsets, encode_errors=encode_errors)
             self.assertTrue(got==aexpected, "Input     %r\nGot:      %r\nExpected: %r" % (val, got, aexpected))
 
+    def test_anglicize_table(self):
+        # The translation table has to match the translate/normalize/encode steps
+        for val in [UNICODE_STR, u"\u2026\u2018x\u2019", u"e\u0316\u0301\u01c4\u00bd", u"\ufb01\u2460\U0001d400", u"ακολουθήστεA"]:
+            for encode_errors in anglicize.TABLE_ENCODE_ERRORS:
+                got = anglicize.anglicize(val, encode_errors=encode_errors)
+                expected = anglicize._normalize(val, encode_errors)
+                self.assertEqual(got, expected, "Input     %r\nGot:      %r\nExpected: %r" % (val, got, expected))
+
+    def test_anglicize_fast_paths(self):
+        text = "ascii-'1234567890-`~!@#$%^&*()_+"
+        self.assertTrue(anglicize.anglicize(text) is text)
+        got = anglicize.anglicize(unicode(text))
+        self.assertEqual(got, text)
+        self.assertTrue(isinstance(got, str))
+        self.assertEqual(anglicize.anglicize(UNICODE_STR + u"\u2026", encode_errors='replace'), "????...")
+
+    def test_anglicize_byte_tables(self):
+        for charset in makeutf8.DEFAULT_CHARSETS[1:]:
+            table = anglicize._byte_table(charset, 'ignore')
+            for b in range(256):
+                try:
+                    u = chr(b).decode(charset)
+                except UnicodeDecodeError:
+                    continue
+                self.assertEqual(table.translate(chr(b)), anglicize._normalize(u, 'ignore'))
+        self.assertEqual(anglicize.anglicize("Caf\xe9 \x85 \x99 \x80", encode_errors='replace'), "Cafe? ... TM ?")
+
+    def test_anglicize_column(self):
+        values = [val for val, uexpected, aexpected, charsets, encode_errors in TEST_VALUES if not charsets]*3
+        expected = [anglicize.anglicize(v) for v in values]
+        self.assertEqual(anglicize.anglicize_column(values), expected)
+        self.assertEqual(anglicize.anglicize_column(iter(values), processes=2, min_parallel=1), expected)
+        got = anglicize.anglicize_column(["a", u"a", None, u""])
+        self.assertEqual(got, ["a", "a", None, u""])
+        self.assertTrue(isinstance(got[1], str))
+
+    @unittest.skipUnless(numpy, "numpy isn't installed")
+    def test_anglicize_column_numpy(self):
+        values = numpy.array([["Caf\xc3\xa9", "abc"], ["M\xfcnchen", "Caf\xc3\xa9"]])
+        got = anglicize.anglicize_column(values)
+        self.assertEqual(got.shape, (2, 2))
+        self.assertEqual(got.dtype, object)
+        self.assertEqual(got.tolist(), [[anglicize.anglicize(v) for v in row] for row in values.tolist()])
+
+    def test_anglicize_stream(self):
+        data = "Caf\xc3\xa9 \xe2\x80\x9cM\xc3\xbcnchen\xe2\x80\x9d \xe2\x80\xa6 e\xcc\x96\xcc\x81 " * 5
+        for encode_errors in ('ignore', 'replace', 'xmlcharrefreplace'):
+            expected = anglicize.anglicize(data, encode_errors=encode_errors)
+            for size in (1, 2, 7):
+                out = StringIO.StringIO()
+                anglicize.anglicize_stream(StringIO.StringIO(data), out, encode_errors=encode_errors, chunk_size=size)
+                self.assertEqual(out.getvalue(), expected)
+
     def test_make_unicode(self):
         for val, u8expected, aexpected, charsets, encode_errors in TEST_VALUES:
             got =  makeutf8.make_unicode(val, charsets)
@@ -113,6 +264,75 @@ class makeutf8TestCase(unittest.TestCase):
         _t({u"U":"U"},  {u"U":u"U"})
         _t({u"U":CP1252_STR},  {u"U":UNICODE_STR})
 
+    def test_make_item_structure(self):
+        # Deeper than the recursion limit
+        deep = inner = []
+        for i in range(5000):
+            inner.append([CP1252_STR])
+            inner = inner[-1]
+        got = makeutf8.makeItemUTF8(deep)
+        for i in range(5000):
+            got = got[-1]
+        self.assertEqual(got, [UTF8_STR])
+
+        # Nothing to convert, so nothing is copied
+        plain = [1, 2.0, (3, None), {4: [5]}]
+        self.assertTrue(makeutf8.makeItemUTF8(plain) is plain)
+
+        # Shared and cyclic parts are converted once
+        shared = [CP1252_STR]
+        cyclic = {"A": shared, "B": shared}
+        cyclic["C"] = cyclic
+        got = makeutf8.makeItemUTF8(cyclic)
+        self.assertEqual(got["A"], [UTF8_STR])
+        self.assertTrue(got["A"] is got["B"])
+        self.assertTrue(got["C"] is got)
+        self.assertFalse(got is cyclic)
+
+        got = makeutf8.make_unicode_item(cyclic, in_place=True)
+        self.assertTrue(got is cyclic)
+        self.assertEqual(shared, [UNICODE_STR])
+        self.assertEqual(sorted(cyclic.keys()), [u"A", u"B", u"C"])
+        self.assertTrue(all([isinstance(k, unicode) for k in cyclic]))
+
+    def test_make_item_types(self):
+        Pair = collections.namedtuple("Pair", "a b")
+        got = makeutf8.make_unicode_item({"S": set(["A", CP1252_STR]),
+                                          "F": frozenset(["A"]),
+                                          "P": Pair(CP1252_STR, 1)})
+        self.assertEqual(got, {u"S": set([u"A", UNICODE_STR]), u"F": frozenset([u"A"]), u"P": Pair(UNICODE_STR, 1)})
+        self.assertTrue(isinstance(got[u"P"], Pair))
+        self.assertTrue(isinstance(got[u"F"], frozenset))
+
+        s = set([CP1252_STR])
+        self.assertTrue(makeutf8.makeItemUTF8(s, in_place=True) is s)
+        self.assertEqual(s, set([UTF8_STR]))
+
+        # Iterators are converted as they're consumed
+        consumed = []
+        def _gen():
+            for i in range(3):
+                consumed.append(i)
+                yield [CP1252_STR, i]
+        got = makeutf8.makeItemUTF8({"G": _gen(), "I": iter(["A"])})
+        self.failIf(consumed)
+        self.assertEqual(got["G"].next(), [UTF8_STR, 0])
+        self.assertEqual(consumed, [0])
+        self.assertEqual(list(got["G"]), [[UTF8_STR, 1], [UTF8_STR, 2]])
+        self.assertEqual(list(got["I"]), ["A"])
+
+        # Files are iterators, but are left alone
+        self.assertTrue(makeutf8.makeItemUTF8([sys.stdout])[0] is sys.stdout)
+
+        # So are old-style class instances and other file-likes
+        class Old:
+            pass
+        old = Old()
+        sio = StringIO.StringIO("A")
+        csio = cStringIO.StringIO("A")
+        got = makeutf8.makeItemUTF8({"O": old, "S": sio, "C": csio})
+        self.assertEqual(got, {"O": old, "S": sio, "C": csio})
+
     def _test_makeitem(self, func, dicts):
         for input, expected in dicts:
             got = makeutf8.makeItemUTF8(input)
@@ -126,6 +346,51 @@ class makeutf8TestCase(unittest.TestCase):
 
 
 
+class TranscodeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.tmp_dir, "src")
+        os.makedirs(os.path.join(self.src_dir, "sub"))
+        self.files = {"cp1252.txt": CP1252_STR*3,
+                      "sub/utf8.txt": UTF8_STR + "\n" + UTF8_STR,
+                      "sub/mixed.txt": UTF8_STR + "\n" + CP1252_STR,
+                      "empty.txt": ""}
+        for name, data in self.files.items():
+            with open(os.path.join(self.src_dir, name), "wb") as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_transcode_tree(self):
+        for jobs in (1, 2):
+            out_dir = os.path.join(self.tmp_dir, "out%s" % jobs)
+            stats = transcode.transcode_tree(self.src_dir, out_dir, jobs=jobs, chunk_size=3)
+            self.assertEqual(stats.files, len(self.files))
+            self.assertEqual(stats.bytes, sum([len(d) for d in self.files.values()]))
+            self.assertEqual(stats.other_charset, 2)
+            self.assertEqual(stats.fallbacks, 1)
+            self.failIf(stats.errors)
+            for name, data in self.files.items():
+                with open(os.path.join(out_dir, name), "rb") as f:
+                    got = f.read()
+                if name=="sub/mixed.txt":
+                    self.assertEqual(got, UTF8_STR + "\n" + UTF8_STR)
+                else:
+                    self.assertEqual(got, makeutf8.makeUTF8(data))
+
+
+    def test_repair(self):
+        out_dir = os.path.join(self.tmp_dir, "out")
+        stats = transcode.transcode_tree(self.src_dir, out_dir, jobs=1, chunk_size=5, repair=True)
+        self.assertEqual(stats.files, len(self.files))
+        self.assertEqual(stats.fallbacks, 2)
+        with open(os.path.join(out_dir, "sub/mixed.txt"), "rb") as f:
+            self.assertEqual(f.read(), UTF8_STR + "\n" + UTF8_STR)
+        with open(os.path.join(out_dir, "cp1252.txt"), "rb") as f:
+            self.assertEqual(f.read(), UTF8_STR*3)
+
+
 class StdWrapperTestCase(unittest.TestCase):
     
 
@@ -156,6 +421,197 @@ class StdWrapperTestCase(unittest.TestCase):
                 raise
             
         
+    def testStdFileBackspaces(self):
+        f = stdwrapper.StdFile(1)
+        f.write("50%")
+        f.write("\b"*100000)
+        f.write("60%\b\b\b")
+        for i in range(1000):
+            f.write("x")
+        self.assertEqual(f.getvalue(), "50%\n60%\n"+"x"*1000)
+        self.assertEqual(f.getvalue(), "50%\n60%\n"+"x"*1000)
+        f.write(u"y")
+        self.assertEqual(f.getvalue(), u"50%\n60%\n"+"x"*1000+u"y")
+        self.assertEqual(stdwrapper.StdFile(1).getvalue(), "")
+        # stdin still reads its text
+        f = stdwrapper.StdFile(0, "line 1\nline 2\n")
+        self.assertEqual(f.readline(), "line 1\n")
+        self.assertEqual(f.getvalue(), "line 1\nline 2\n")
+        
+    def testCaptureLimits(self):
+        f = stdwrapper.StdFile(1, max_lines=2)
+        for i in range(1000):
+            f.write("line %s\n" % i)
+        self.assertEqual(f.getvalue(), "line 998\nline 999\n")
+        self.assertTrue(len(f._chunks)<=3, len(f._chunks))
+        f.write("part")
+        self.assertEqual(f.getvalue(), "line 998\nline 999\npart")
+        # getvalue() joins the chunks; writes after it still drop the joined one
+        f = stdwrapper.StdFile(1, max_lines=5)
+        for i in range(20):
+            f.write("line %s\n" % i)
+            f.getvalue()
+        self.assertEqual(f.getvalue(), "".join("line %s\n" % i for i in range(15, 20)))
+        self.assertEqual(list(f._chunk_lines), [f._lines])
+        f = stdwrapper.StdFile(1, max_bytes=5)
+        for c in "abcdefghij":
+            f.write(c)
+        self.assertEqual(f.getvalue(), "fghij")
+        self.assertRaises(ValueError, stdwrapper.StdFile, 1, max_bytes=5, spill_size=10)
+
+        stw = stdwrapper.StdWrapper(spill_size=10)
+        try:
+            sys.stdout.write("short")
+            sout, serr = stw.get()
+            self.assertEqual(sout, "short")
+            sys.stdout.write(u" and long–")
+            print >>sys.stderr, "err"
+        finally:
+            sout, serr = stw.done()
+        self.assertEqual(serr, "err\n")
+        self.assertFalse(os.path.exists(stw.tmpstdout._spill_path))
+        try:
+            self.assertEqual(sout.read(), "short and long\xe2\x80\x93")
+        finally:
+            sout.close()
+
+    def testThreadLocal(self):
+        saved_stdout = sys.stdout
+        started = threading.Event()
+        finished = threading.Event()
+        results = {}
+        def work():
+            stw = stdwrapper.StdWrapper(thread_local=True, inputText="input a\n")
+            try:
+                print "out a",
+                started.set()
+                finished.wait(5)
+                print sys.stdin.readline().strip()
+                sys.stderr.write("err a\n")
+            finally:
+                results["a"] = stw.done()
+        thread = threading.Thread(target=work)
+        thread.start()
+        started.wait(5)
+        # a second capture, in this thread, while the other one is still going
+        stw = stdwrapper.StdWrapper(thread_local=True, inputText="input b\n")
+        try:
+            print "out b",
+            finished.set()
+            thread.join()
+            print sys.stdin.readline().strip()
+            sys.stderr.write("err b\n")
+        finally:
+            results["b"] = stw.done()
+        self.assertEqual(results, {"a": ("out a input a\n", "err a\n"),
+                                   "b": ("out b input b\n", "err b\n")})
+        self.assertTrue(sys.stdout is saved_stdout)
+        self.assertFalse(stdwrapper._DISPATCHERS)
+
+    def testThreadLocalIterStdin(self):
+        saved_stdin = sys.stdin
+        sys.stdin = StringIO.StringIO("real 1\nreal 2\n")
+        results = {}
+        try:
+            stw = stdwrapper.StdWrapper(thread_local=True, inputText="line 1\nline 2\n")
+            try:
+                def work():
+                    results["other"] = [line for line in sys.stdin]
+                thread = threading.Thread(target=work)
+                thread.start()
+                thread.join()
+                results["captured"] = [line for line in sys.stdin]
+            finally:
+                stw.done()
+        finally:
+            sys.stdin = saved_stdin
+        self.assertEqual(results, {"other": ["real 1\n", "real 2\n"],
+                                   "captured": ["line 1\n", "line 2\n"]})
+
+    def testThreadLocalPassthru(self):
+        # nested in this thread
+        outer = stdwrapper.StdWrapper(thread_local=True)
+        try:
+            inner = stdwrapper.StdWrapper(thread_local=True, passthru=True)
+            try:
+                print "nested"
+            finally:
+                inner_out = inner.done()[0]
+        finally:
+            outer_out = outer.done()[0]
+        self.assertEqual((inner_out, outer_out), ("nested\n", "nested\n"))
+
+        # while another thread is capturing
+        started = threading.Event()
+        finished = threading.Event()
+        results = {}
+        def work():
+            stw = stdwrapper.StdWrapper(thread_local=True)
+            try:
+                started.set()
+                finished.wait(5)
+            finally:
+                results["other"] = stw.done()[0]
+        thread = threading.Thread(target=work)
+        thread.start()
+        started.wait(5)
+        outer = stdwrapper.StdWrapper()
+        try:
+            stw = stdwrapper.StdWrapper(thread_local=True, passthru=True)
+            try:
+                print "passed"
+            finally:
+                results["inner"] = stw.done()[0]
+        finally:
+            finished.set()
+            thread.join()
+            results["outer"] = outer.done()[0]
+        self.assertEqual(results, {"other": "", "inner": "passed\n", "outer": "passed\n"})
+        self.assertFalse(isinstance(sys.stdout, stdwrapper.ThreadDispatch))
+        self.assertFalse(stdwrapper._DISPATCHERS)
+
+    def testCaptureFds(self):
+        code = "import os; os.write(1, 'x'*(1024*1024)+'\\nchild out\\n'); os.write(2, 'child err\\n')"
+        fd1 = os.fstat(1)
+        stw = stdwrapper.StdWrapper(capture_fds=True)
+        try:
+            print "python out"
+            # a child writing more than a pipe holds, with nobody calling get() meanwhile
+            subprocess.check_call([sys.executable, "-c", code])
+            os.write(2, "fd err\n")
+        finally:
+            sout, serr = stw.done()
+        self.assertIn("python out\n", sout)
+        self.assertIn("x"*(1024*1024)+"\nchild out\n", sout)
+        self.assertEqual(serr, "child err\nfd err\n")
+        # fd 1 is back where it was
+        self.assertEqual((os.fstat(1).st_dev, os.fstat(1).st_ino), (fd1.st_dev, fd1.st_ino))
+        self.assertRaises(ValueError, stdwrapper.StdWrapper, thread_local=True, capture_fds=True)
+
+    def testProgress(self):
+        outer_stw = stdwrapper.StdWrapper()
+        try:
+            stw = stdwrapper.StdWrapper(progress_interval=0.05)
+            try:
+                for i in range(20000):
+                    stw.progress("%s done" % i)
+                stw.progress("step 1\nstep 2\nfinishing")
+                stw.progress("finished")
+                self.assertTrue(stw._renderer.is_alive())
+            finally:
+                inner_sout, inner_serr = stw.done()
+            # after done() it's drawn straight away
+            stw.progress("after done")
+            self.assertTrue(stw._renderer is None)
+        finally:
+            outer_sout, outer_serr = outer_stw.done()
+        lines = inner_serr.split("\n")
+        # far fewer redraws than calls, but nothing finished is lost, and it ends on the last one
+        self.assertTrue(len(lines)<1000, len(lines))
+        self.assertEqual(lines[-4:], ["step 1", "step 2", "finished", ""])
+        self.assertTrue(outer_serr.endswith("step 1\nstep 2\nfinished\nafter done"), repr(outer_serr[-50:]))
+        self.assertTrue(stw._renderer is None)
+
     def one_run(self, wrapOutput, inputText, inputFileName, 
                 combine_stdout_and_stderr,  passthru=False,
                 progress_strings=None):
@@ -266,6 +722,27 @@ class StdWrapperTestCase(unittest.TestCase):
             for s in progress_strings:
                 self.assertIn(s, serr)                
 
+class DisplaywidthTestCase(unittest.TestCase):
+
+    def test_display_width(self):
+        for text, width in [(u"abc", 3), (u"", 0),
+                            (u"\u4e2d\u6587\xe1b", 6),        # CJK are two columns
+                            (u"e\u0301", 1), (u"\u200b", 0),   # combining and zero width
+                            (u"\uff21", 2), (u"\u1100\u1161", 2), (u"\xad", 1),
+                            ]:
+            self.assertEqual(displaywidth.display_width(text), width, repr(text))
+        self.assertEqual(displaywidth.display_widths([u"a", u"bc"]), None)
+        self.assertEqual(displaywidth.display_widths([u"a", u"\u4e2d"]), [1, 2])
+        self.assertEqual(displaywidth.display_widths([u"a", u"e\u0301\u4e2d", u"bc", u"\u4e2d\uffff"]), [1, 3, 2, 3])
+        # Only non-ascii cells are measured, whatever else is in the column
+        self.assertEqual(displaywidth.display_widths([u"a\u4e2d", u"b"]*3+[u"\u0301"]), [3, 1]*3+[0])
+        col = [u"caf\xe9 %s" % i if i%3 else u"cafe %s" % i for i in range(200)]
+        col[63] = col[64] = u"\u4e2d"
+        self.assertEqual(displaywidth.display_widths(col), map(displaywidth.display_width, col))
+        self.assertEqual(displaywidth._width(0x378), 1)   # not assigned
+        # The shipped table is what the unicodedata here makes
+        self.assertEqual(displaywidth.WIDTH_RUNS, list(displaywidth._build_table()))
+
 class PrintrowsTestCase(unittest.TestCase):
     
     def test_emptyrows(self):
@@ -391,6 +868,155 @@ class PrintrowsTestCase(unittest.TestCase):
                 saw_max = True
         self.assertTrue(saw_max)
 
+    def _stream(self, rows, **kwargs):
+        out = StringIO.StringIO()
+        printrows.stream_rows_as_text(rows, out=out, **kwargs)
+        return out.getvalue()
+
+    def test_stream_rows(self):
+        rows = [("A", "B\nBB", "C")] + [(i, "b"*(i%7), u"c\u2013%s" % i) for i in range(50)]
+        expected = printrows.sprint_rows_as_text(rows)
+        for kwargs in [{}, {"exact":True}, {"sample_size":60}, {"col_lens":[2, 6, 4]}]:
+            got = self._stream(iter(rows), **kwargs)
+            self.assertEqual(got, expected, "%s\n%s\n%s" % (kwargs, got, expected))
+        # A small sample just lets wider rows stick out
+        got = self._stream(iter(rows), sample_size=2)
+        self.assertEqual(got.split("\n")[2], "=  ==  ===")
+        self.assertEqual(self._stream(iter([])), "")
+        self.assertEqual(self._stream(iter([]), exact=True), "")
+
+    def test_stream_rows_as_they_come(self):
+        out = StringIO.StringIO()
+        written = []
+        def rows():
+            yield ("A", "B")
+            for i in range(3):
+                yield (i, "b")
+                written.append(out.getvalue().count("\n"))
+        printrows.stream_rows_as_text(rows(), col_lens=[1, 1], out=out, flush_interval=0)
+        # header, separator, then each row as soon as it's given
+        self.assertEqual(written, [3, 4, 5])
+        self.assertEqual(out.getvalue(), "A  B\n=  =\n0  b\n1  b\n2  b\n")
+        self.assertEqual(self._stream(rows(), sample_size=1, batch_rows=2), "A  B\n=  =\n0  b\n1  b\n2  b\n")
+        # or batch_rows at a time, when they come quicker than flush_interval
+        del written[:]
+        out = StringIO.StringIO()
+        printrows.stream_rows_as_text(rows(), col_lens=[1, 1], out=out, batch_rows=2, flush_interval=60)
+        self.assertEqual(written, [2, 4, 4])
+        self.assertEqual(out.getvalue(), "A  B\n=  =\n0  b\n1  b\n2  b\n")
+
+    def test_stream_rows_one_at_a_time(self):
+        # once the widths are known rows are formatted one by one, the same as a whole table
+        rows = [("A", "B", "C"), (1, "b\nbb", u"\u4e2d"), (2, u"e\u0301"), (3.5, "b", "c")]
+        col_lens = [3, 2, 2]
+        expected = printrows.sprint_rows_as_text(rows, col_lens=col_lens)
+        self.assertEqual(self._stream(iter(rows), col_lens=col_lens), expected)
+        rows = [(1, "b", u"\u4e2d"), (2, u"e\u0301", "c"), (3.25, "b", "c")]
+        formats = [u"%%%s.1f", u"%%-%ss", u"%%-%ss"]
+        expected = printrows.sprint_rows_as_text(rows, False, col_lens, formats)
+        self.assertEqual(self._stream(iter(rows), first_is_header=False, col_lens=col_lens, formats=formats), expected)
+
+    def test_render_to_file(self):
+        rows = [("A", "B"), (1, u"b\u2013")]
+        expected = printrows.sprint_rows_as_text(rows)
+        self.assertEqual(expected, u"A  B\n=  ==\n1  b\u2013\n")
+        out = StringIO.StringIO()
+        self.assertEqual(printrows.render_rows_as_text(rows, out, encoding='utf-8'), None)
+        self.assertEqual(out.getvalue(), expected.encode('utf-8'))
+        self.assertEqual(printrows.sprint_rows_as_text([]), u"")
+        # print_rows_as_text writes to whatever sys.stdout is, without replacing it
+        saved_sout = sys.stdout
+        sys.stdout = out = StringIO.StringIO()
+        try:
+            printrows.print_rows_as_text([("A", "B"), (1, 2)])
+            self.assertTrue(sys.stdout is out)
+        finally:
+            sys.stdout = saved_sout
+        self.assertEqual(out.getvalue(), "A  B\n=  =\n1  2\n")
+
+    def test_render_in_parallel(self):
+        rows = [("A", "B\nBB", "C")] + [(i, "b"*(i%7), u"c\u2013%s" % i) for i in range(50)]
+        for first_is_header, formats in [(True, None), (False, None), (True, [u"%%%ss", u"%%-%ss", u"%%-%ss"])]:
+            expected = printrows.sprint_rows_as_text(rows, first_is_header, formats=formats)
+            for jobs in [1, 2]:
+                got = printrows.render_rows_in_parallel(rows, None, first_is_header, formats=formats, jobs=jobs, chunk_rows=7)
+                self.assertEqual(got, expected, "%s %s\n%s\n%s" % (first_is_header, jobs, got, expected))
+        out = StringIO.StringIO()
+        printrows.render_rows_in_parallel(rows, out, encoding='utf-8', jobs=2, chunk_rows=9)
+        self.assertEqual(out.getvalue(), printrows.sprint_rows_as_text(rows).encode('utf-8'))
+        self.assertEqual(printrows.render_rows_in_parallel([], jobs=1), u"")
+
+    def test_live_table(self):
+        out = StringIO.StringIO()
+        table = printrows.LiveTable(("A", "B"), tail=2, out=out)
+        table.append((1, "b"))
+        table.extend([(22, "bb"), (3, "b")])
+        self.assertEqual(out.getvalue().split("\n"),
+                         ["A  B", "=  =", "1  b",
+                          # header again only when a column widens
+                          "A   B", "==  ==", "22  bb", "3   b", ""])
+        self.assertEqual(table.render(), u"A   B\n==  ==\n22  bb\n3   b\n")
+        # fixed widths: wider rows stick out
+        out = StringIO.StringIO()
+        table = printrows.LiveTable(("A", "B"), col_lens=[1, 1], grow=False, out=out)
+        table.extend([(1, "b"), (22, "bb")])
+        self.assertEqual(out.getvalue(), "A  B\n=  =\n1  b\n22  bb\n")
+        self.assertEqual(table.render(), u"A  B\n=  =\n")
+
+    def test_columns(self):
+        columns = collections.OrderedDict([("name", ["a", u"b\u2013", "ccc"]),
+                                           ("count", [1, 22, 3]),
+                                           ("ratio", [0.5, 1, 10.125])])
+        self.assertEqual(printrows.sprint_columns_as_text(columns).split("\n"),
+                         [u"name  count  ratio",
+                          u"====  =====  =====",
+                          u"a         1   0.50",
+                          u"b\u2013       22   1.00",
+                          u"ccc       3  10.12",
+                          u""])
+        # a plain dict's columns are sorted, unless names says otherwise
+        columns = {"b": [1, 2], "a": ["x"]}
+        self.assertEqual(printrows.sprint_columns_as_text(columns, header=False), u"x  1\n   2\n")
+        self.assertEqual(printrows.sprint_columns_as_text(columns, names=["b"], float_precision=1), u"b\n=\n1\n2\n")
+        self.assertEqual(printrows.sprint_columns_as_text({}), u"")
+
+    @unittest.skipUnless(numpy, "numpy isn't installed")
+    def test_columns_numpy(self):
+        columns = numpy.array([("a", 1, 0.5), ("b\xe2\x80\x93", 22, 1), ("ccc", 3, 10.125)],
+                              dtype=[("name", "S8"), ("count", "i4"), ("ratio", "f8")])
+        self.assertEqual(printrows.sprint_columns_as_text(columns).split("\n"),
+                         [u"name  count  ratio",
+                          u"====  =====  =====",
+                          u"a         1   0.50",
+                          u"b\u2013       22   1.00",
+                          u"ccc       3  10.12",
+                          u""])
+        self.assertEqual(printrows.sprint_columns_as_text(columns, names=["ratio", "count"], header=False, float_precision=1),
+                         u" 0.5   1\n 1.0  22\n10.1   3\n")
+        # a dict of arrays comes out the same as the lists would
+        columns = collections.OrderedDict([("count", numpy.arange(3, dtype="u2")), ("ratio", numpy.array([], "f4"))])
+        self.assertEqual(printrows.sprint_columns_as_text(columns),
+                         printrows.sprint_columns_as_text(dict((k, v.tolist()) for k, v in columns.items())))
+
+    def test_cells_stringified_once(self):
+        calls = []
+        class Cell(object):
+            def __unicode__(self):
+                calls.append(1)
+                return u"cell\u2013"
+        rows = [("A", "B"), (Cell(), "utf8-\xc3\xa4\xc3\xb6\xc3\xbc"), (1, 2.5)]
+        sout = printrows.sprint_rows_as_text(rows)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sout.split("\n")[2], u"cell\u2013  utf8-\xe4\xf6\xfc")
+        self.assertEqual(sout.split("\n")[1], u"=====  ========")
+
+    def test_wide_chars(self):
+        rows = [("Name", "N"), (u"\u6771\u4eac", 1), (u"Cafe\u0301", 22), ("Paris", 333)]
+        self.assertEqual(printrows.sprint_rows_as_text(rows).split("\n"),
+                         [u"Name   N", u"=====  ===", u"\u6771\u4eac   1", u"Cafe\u0301   22", u"Paris  333", u""])
+        lines = printrows.sprint_rows_as_text(rows, formats=[u"%%-%ss", u"%%%ss"]).split("\n")
+        self.assertEqual(lines[2:5], [u"\u6771\u4eac     1", u"Cafe\u0301    22", u"Paris  333"])
+
     def test_unicode(self):
          rows = [["A", "B", "C", "D", "E", "F"],
                  ['Account', 'Business_Classification_Cleansed__c', u'Business Classification \u2013 Cleansed', 'string(13)', '', '']]
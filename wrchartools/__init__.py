@@ -1,2 +1,2 @@
 #
-all = ["makeutf8", "printrows", "stdwrapper", "anglicize", "asciihist"]
+all = ["makeutf8", "printrows", "stdwrapper", "anglicize", "asciihist", "transcode", "displaywidth"]
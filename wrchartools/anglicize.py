@@ -1,37 +1,261 @@
-# 
-# anglicize -- convert strings to just plain ascii
-# Rev 0.1
-#
-
-import string, unicodedata, makeutf8
-
-UNICODE_SPECIAL_CHARS = {0x2018:u"'",
-                         0x2019:u"'",
-                         0x201a:u"'",
-                         
-                         0x201C:u'"',
-                         0x201D:u'"',
-                         0x201E:u'"',
-                         
-                         0x2013:u'-',
-                         0x2014:u'-',
-                         0x2028:u' ',
-                         }                             
-
-def anglicize(text, raiseExceptions=False, charsets=[], encode_errors='ignore'):    
-    """turns text into an ASCII string with a decent try to make latin-1 characters become simple ascii"""
-
-    if not text:
-        return text
-    temp = makeutf8.makeUTF8(text, charsets=charsets) # make it a utf8 string
-    if not isinstance(temp, unicode):
-        temp = unicode(temp, 'utf-8')        # make it unicode
-        
-    # Do the translation BEFORE the noralize/encode makes them blanks
-    if encode_errors!='xmlcharrefreplace':
-        temp = temp.translate(UNICODE_SPECIAL_CHARS) # fix the cp1252 characters
-        temp = temp.replace('\u2026' ,"...") # handle the elipsis, since it's a 1 char -> 3 chars
-    
-    fixed = unicodedata.normalize('NFKD', temp).encode('ASCII', encode_errors) # do the official normalize
-    return fixed
- 
\ No newline at end of file
+# 
+# anglicize -- convert strings to just plain ascii
+# Rev 0.1
+#
+
+import re, string, itertools, unicodedata, makeutf8
+
+UNICODE_SPECIAL_CHARS = {0x2018:u"'",
+                         0x2019:u"'",
+                         0x201a:u"'",
+                         
+                         0x201C:u'"',
+                         0x201D:u'"',
+                         0x201E:u'"',
+                         
+                         0x2013:u'-',
+                         0x2014:u'-',
+                         0x2028:u' ',
+                         }                             
+
+_NON_ASCII_STR = re.compile('[\x80-\xff]')
+_NON_ASCII_UNICODE = re.compile(u'[^\x00-\x7f]')
+
+# -- encode_errors modes the translation tables can do.  Both turn each code point
+#    into the same output wherever it is, unlike e.g. xmlcharrefreplace, where the
+#    normalize step can reorder combining characters.
+TABLE_ENCODE_ERRORS = ('ignore', 'replace')
+
+class _TranslationTable(dict):
+    """Maps each code point straight to its final ascii output (the special chars, the
+       NFKD normalize and the encode all in one), for unicode.translate.  Code points
+       are filled in the first time they're seen.
+    """
+    def __init__(self, encode_errors):
+        dict.__init__(self)
+        self.encode_errors = encode_errors
+        
+    def __missing__(self, cp):
+        temp = UNICODE_SPECIAL_CHARS.get(cp, unichr(cp))
+        fixed = unicodedata.normalize('NFKD', temp).encode('ASCII', self.encode_errors)
+        value = self[cp] = unicode(fixed) or None
+        return value
+
+_TABLES = {}
+
+def _translation_table(encode_errors):
+    if encode_errors not in TABLE_ENCODE_ERRORS:
+        return None
+    try:
+        return _TABLES[encode_errors]
+    except KeyError:
+        table = _TABLES[encode_errors] = _TranslationTable(encode_errors)
+        return table
+
+class _ByteTable(object):
+    """The ascii output for each byte of a single byte charset, as str.translate args.
+       Bytes that turn into more than one character (the ellipsis, TM...) are
+       replaced first, since translate can only do one for one.
+    """
+    def __init__(self, charset, encode_errors):
+        table = _translation_table(encode_errors)
+        chars = []
+        deletes = []
+        self.replaces = []
+        self.ascii_safe = True
+        for b in range(256):
+            try:
+                cp = ord(chr(b).decode(charset))
+            except UnicodeDecodeError:
+                # -- sniffing rules out data with these bytes
+                cp = b
+            out = table[cp]
+            if out is None:
+                out = ''
+            out = out.encode('ASCII')
+            if b<0x80 and out!=chr(b):
+                # -- e.g. EBCDIC, where the replaced text would get translated again
+                self.ascii_safe = False
+            if len(out)==1:
+                chars.append(out)
+            else:
+                chars.append(chr(b))
+                if out:
+                    self.replaces.append((chr(b), out))
+                else:
+                    deletes.append(chr(b))
+        self.table = ''.join(chars)
+        self.deletes = ''.join(deletes)
+        
+    def translate(self, text):
+        for b, out in self.replaces:
+            if b in text:
+                text = text.replace(b, out)
+        return text.translate(self.table, self.deletes)
+
+_BYTE_TABLES = {}
+
+def _byte_table(charset, encode_errors):
+    name, bad = makeutf8._charset_class(charset)
+    if bad is None or encode_errors not in TABLE_ENCODE_ERRORS:
+        return None
+    key = (name, encode_errors)
+    try:
+        return _BYTE_TABLES[key]
+    except KeyError:
+        table = _BYTE_TABLES[key] = _ByteTable(charset, encode_errors)
+        if not table.ascii_safe:
+            table = _BYTE_TABLES[key] = None
+        return table
+
+# -- Precompute the tables for the usual charsets
+for _charset in makeutf8.DEFAULT_CHARSETS:
+    for _encode_errors in TABLE_ENCODE_ERRORS:
+        _byte_table(_charset, _encode_errors)
+
+def _normalize(temp, encode_errors):
+    # Do the translation BEFORE the noralize/encode makes them blanks
+    if encode_errors!='xmlcharrefreplace':
+        temp = temp.translate(UNICODE_SPECIAL_CHARS) # fix the cp1252 characters
+        temp = temp.replace(u'\u2026' ,u"...") # handle the elipsis, since it's a 1 char -> 3 chars
+    
+    return unicodedata.normalize('NFKD', temp).encode('ASCII', encode_errors) # do the official normalize
+
+def anglicize(text, raiseExceptions=False, charsets=[], encode_errors='ignore'):    
+    """turns text into an ASCII string with a decent try to make latin-1 characters become simple ascii"""
+
+    if not text:
+        return text
+    # -- Pure ascii needs no work, and there's no need to round trip unicode
+    #    or str through utf-8 to get it to unicode
+    if isinstance(text, str):
+        if not _NON_ASCII_STR.search(text):
+            return text
+        charset, temp = makeutf8._sniff(text, charsets)
+        if temp is None:
+            # -- A single byte charset goes straight from bytes to ascii
+            byte_table = _byte_table(charset, encode_errors) if charset else None
+            if byte_table is not None:
+                return byte_table.translate(text)
+            temp = makeutf8.make_unicode(text, charsets)
+    elif isinstance(text, unicode):
+        if not _NON_ASCII_UNICODE.search(text):
+            return text.encode('ASCII')
+        temp = text
+    else:
+        temp = unicode(makeutf8.makeUTF8(text, charsets=charsets), 'utf-8')
+        
+    table = _translation_table(encode_errors)
+    if table is not None:
+        return temp.translate(table).encode('ASCII')
+    return _normalize(temp, encode_errors)
+
+DEFAULT_MIN_PARALLEL = 10000
+
+def _anglicize_job(args):
+    text, charsets, encode_errors = args
+    return anglicize(text, charsets=charsets, encode_errors=encode_errors)
+
+def anglicize_column(values, raiseExceptions=False, charsets=[], encode_errors='ignore', 
+                     processes=None, min_parallel=DEFAULT_MIN_PARALLEL):
+    """anglicizes a whole column of values -- a list, an iterator or a NumPy array.
+
+       Each distinct value is only converted once.  If processes is set and there are
+       at least min_parallel distinct values, they're converted on a process pool.
+       Returns a list, or an object array of the same shape for a NumPy array.
+    """
+    shape = None
+    if hasattr(values, 'dtype') and hasattr(values, 'shape'):
+        # -- NumPy array; tolist() turns numpy.string_ etc into plain python values
+        shape = values.shape
+        values = values.ravel().tolist()
+    elif not isinstance(values, list):
+        values = list(values)
+        
+    # -- Keyed on the type too, so e.g. 'a' and u'a' each keep their own result
+    distinct = {}
+    for v in values:
+        try:
+            distinct[(type(v), v)] = None
+        except TypeError:
+            pass
+    keys = distinct.keys()
+    jobs = [(v, charsets, encode_errors) for t, v in keys]
+    if processes and len(jobs)>=min_parallel:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_anglicize_job, jobs, max(1, len(jobs)//(processes*4)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(_anglicize_job, jobs)
+    distinct = dict(itertools.izip(keys, results))
+    
+    out = []
+    for v in values:
+        try:
+            out.append(distinct[(type(v), v)])
+        except (KeyError, TypeError):
+            out.append(anglicize(v, charsets=charsets, encode_errors=encode_errors))
+    if shape is not None:
+        import numpy
+        column = numpy.empty(len(out), dtype=object)
+        column[:] = out
+        return column.reshape(shape)
+    return out
+
+def _stable_len(temp):
+    # -- normalize can reorder combining characters after a starter, so everything from
+    #    the last starter on waits for the next chunk, in case more marks follow
+    for idx in xrange(len(temp)-1, -1, -1):
+        if not unicodedata.combining(temp[idx]):
+            return idx
+    return 0
+
+def anglicize_stream(infile, outfile, charsets=None, encode_errors='ignore', chunk_size=makeutf8.DEFAULT_CHUNK_SIZE):
+    """anglicizes a file-like object (or an iterator of byte chunks) into outfile a chunk at a time"""
+    table = _translation_table(encode_errors)
+    held = u""
+    for temp in makeutf8.iter_unicode(infile, charsets, chunk_size):
+        if table is not None:
+            outfile.write(temp.translate(table).encode('ASCII'))
+            continue
+        temp = held + temp
+        idx = _stable_len(temp)
+        held = temp[idx:]
+        if idx:
+            outfile.write(_normalize(temp[:idx], encode_errors))
+    if held:
+        outfile.write(_normalize(held, encode_errors))
+
+def main(argv=None):
+    import sys, optparse
+    parser = optparse.OptionParser(usage="%prog [options] [FILE ...]",
+                                   description="Convert FILEs (or stdin) to plain ascii on stdout")
+    parser.add_option("-c", "--charsets", default=",".join(makeutf8.DEFAULT_CHARSETS),
+                      help="comma separated charsets to try, in order [%default]")
+    parser.add_option("-e", "--encode-errors", default="ignore",
+                      help="what to do with characters that have no ascii version: ignore, replace, xmlcharrefreplace... [%default]")
+    parser.add_option("--chunk-size", type="int", default=makeutf8.DEFAULT_CHUNK_SIZE,
+                      help="bytes read at a time [%default]")
+    options, args = parser.parse_args(argv)
+    
+    charsets = [c.strip() for c in options.charsets.split(",") if c.strip()]
+    for file_name in args or ["-"]:
+        if file_name=="-":
+            infile = sys.stdin
+        else:
+            infile = open(file_name, "rb")
+        try:
+            anglicize_stream(infile, sys.stdout, charsets, options.encode_errors, options.chunk_size)
+        finally:
+            if infile is not sys.stdin:
+                infile.close()
+    sys.stdout.flush()
+    return 0
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
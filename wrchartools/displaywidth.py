@@ -0,0 +1,189 @@
+#
+# displaywidth -- how many terminal columns unicode text takes up
+#
+#   East Asian wide/fullwidth characters take two columns, combining marks and
+#   other zero width characters none, everything else one.
+#
+
+import re, sys, bisect, unicodedata
+
+_NON_ASCII_UNICODE = re.compile(u'[^\x00-\x7f]')
+
+# -- Only these planes have code points that aren't one column wide (in the
+#    unicodedata python has), so the table is built from just them
+TABLE_PLANES = [(0x80, 0x30000), (0xE0000, 0xE1000)]
+
+# -- Emoji that are wide in later unicode versions than python's unicodedata, and
+#    the CJK blocks, where code points that aren't assigned yet are wide too
+EXTRA_WIDE_RANGES = [(0x1F300, 0x1F650), (0x1F680, 0x1F700), (0x1F900, 0x1FA00),
+                     (0x3400, 0x4DC0), (0x4E00, 0xA000), (0xF900, 0xFB00), (0x20000, 0x2FFFE)]
+
+def _char_width(cp):
+    if cp==0xAD:
+        # -- soft hyphen shows up as a hyphen
+        return 1
+    if 0x1160<=cp<0x1200:
+        # -- Hangul medial vowels and final consonants join onto the syllable before
+        return 0
+    c = unichr(cp)
+    category = unicodedata.category(c)
+    if category in ('Mn', 'Me', 'Cf'):
+        return 0
+    # -- python 2's unicodedata says code points that aren't assigned are fullwidth
+    if category!='Cn' and unicodedata.east_asian_width(c) in ('W', 'F'):
+        return 2
+    for start, end in EXTRA_WIDE_RANGES:
+        if start<=cp<end:
+            return 2
+    return 1
+
+def _build_table():
+    """Yields (start, end, width) for the runs of code points that aren't one column wide"""
+    for plane_start, plane_end in TABLE_PLANES:
+        plane_end = min(plane_end, sys.maxunicode+1)
+        run_start, run_width = plane_start, 1
+        for cp in xrange(plane_start, plane_end):
+            width = _char_width(cp)
+            if width!=run_width:
+                if run_width!=1:
+                    yield run_start, cp, run_width
+                run_start, run_width = cp, width
+        if run_width!=1 and run_start<plane_end:
+            yield run_start, plane_end, run_width
+
+# -- What _build_table() yields, so it doesn't have to be worked out in every process.
+#    Regenerate with:  python displaywidth.py
+WIDTH_RUNS = [
+    (0x300, 0x370, 0), (0x483, 0x48A, 0), (0x591, 0x5BE, 0), (0x5BF, 0x5C0, 0),
+    (0x5C1, 0x5C3, 0), (0x5C4, 0x5C6, 0), (0x5C7, 0x5C8, 0), (0x600, 0x604, 0),
+    (0x610, 0x61B, 0), (0x64B, 0x65F, 0), (0x670, 0x671, 0), (0x6D6, 0x6E5, 0),
+    (0x6E7, 0x6E9, 0), (0x6EA, 0x6EE, 0), (0x70F, 0x710, 0), (0x711, 0x712, 0),
+    (0x730, 0x74B, 0), (0x7A6, 0x7B1, 0), (0x7EB, 0x7F4, 0), (0x816, 0x81A, 0),
+    (0x81B, 0x824, 0), (0x825, 0x828, 0), (0x829, 0x82E, 0), (0x900, 0x903, 0),
+    (0x93C, 0x93D, 0), (0x941, 0x949, 0), (0x94D, 0x94E, 0), (0x951, 0x956, 0),
+    (0x962, 0x964, 0), (0x981, 0x982, 0), (0x9BC, 0x9BD, 0), (0x9C1, 0x9C5, 0),
+    (0x9CD, 0x9CE, 0), (0x9E2, 0x9E4, 0), (0xA01, 0xA03, 0), (0xA3C, 0xA3D, 0),
+    (0xA41, 0xA43, 0), (0xA47, 0xA49, 0), (0xA4B, 0xA4E, 0), (0xA51, 0xA52, 0),
+    (0xA70, 0xA72, 0), (0xA75, 0xA76, 0), (0xA81, 0xA83, 0), (0xABC, 0xABD, 0),
+    (0xAC1, 0xAC6, 0), (0xAC7, 0xAC9, 0), (0xACD, 0xACE, 0), (0xAE2, 0xAE4, 0),
+    (0xB01, 0xB02, 0), (0xB3C, 0xB3D, 0), (0xB3F, 0xB40, 0), (0xB41, 0xB45, 0),
+    (0xB4D, 0xB4E, 0), (0xB56, 0xB57, 0), (0xB62, 0xB64, 0), (0xB82, 0xB83, 0),
+    (0xBC0, 0xBC1, 0), (0xBCD, 0xBCE, 0), (0xC3E, 0xC41, 0), (0xC46, 0xC49, 0),
+    (0xC4A, 0xC4E, 0), (0xC55, 0xC57, 0), (0xC62, 0xC64, 0), (0xCBC, 0xCBD, 0),
+    (0xCBF, 0xCC0, 0), (0xCC6, 0xCC7, 0), (0xCCC, 0xCCE, 0), (0xCE2, 0xCE4, 0),
+    (0xD41, 0xD45, 0), (0xD4D, 0xD4E, 0), (0xD62, 0xD64, 0), (0xDCA, 0xDCB, 0),
+    (0xDD2, 0xDD5, 0), (0xDD6, 0xDD7, 0), (0xE31, 0xE32, 0), (0xE34, 0xE3B, 0),
+    (0xE47, 0xE4F, 0), (0xEB1, 0xEB2, 0), (0xEB4, 0xEBA, 0), (0xEBB, 0xEBD, 0),
+    (0xEC8, 0xECE, 0), (0xF18, 0xF1A, 0), (0xF35, 0xF36, 0), (0xF37, 0xF38, 0),
+    (0xF39, 0xF3A, 0), (0xF71, 0xF7F, 0), (0xF80, 0xF85, 0), (0xF86, 0xF88, 0),
+    (0xF90, 0xF98, 0), (0xF99, 0xFBD, 0), (0xFC6, 0xFC7, 0), (0x102D, 0x1031, 0),
+    (0x1032, 0x1038, 0), (0x1039, 0x103B, 0), (0x103D, 0x103F, 0), (0x1058, 0x105A, 0),
+    (0x105E, 0x1061, 0), (0x1071, 0x1075, 0), (0x1082, 0x1083, 0), (0x1085, 0x1087, 0),
+    (0x108D, 0x108E, 0), (0x109D, 0x109E, 0), (0x1100, 0x1160, 2), (0x1160, 0x1200, 0),
+    (0x135F, 0x1360, 0), (0x1712, 0x1715, 0), (0x1732, 0x1735, 0), (0x1752, 0x1754, 0),
+    (0x1772, 0x1774, 0), (0x17B4, 0x17B6, 0), (0x17B7, 0x17BE, 0), (0x17C6, 0x17C7, 0),
+    (0x17C9, 0x17D4, 0), (0x17DD, 0x17DE, 0), (0x180B, 0x180E, 0), (0x18A9, 0x18AA, 0),
+    (0x1920, 0x1923, 0), (0x1927, 0x1929, 0), (0x1932, 0x1933, 0), (0x1939, 0x193C, 0),
+    (0x1A17, 0x1A19, 0), (0x1A56, 0x1A57, 0), (0x1A58, 0x1A5F, 0), (0x1A60, 0x1A61, 0),
+    (0x1A62, 0x1A63, 0), (0x1A65, 0x1A6D, 0), (0x1A73, 0x1A7D, 0), (0x1A7F, 0x1A80, 0),
+    (0x1B00, 0x1B04, 0), (0x1B34, 0x1B35, 0), (0x1B36, 0x1B3B, 0), (0x1B3C, 0x1B3D, 0),
+    (0x1B42, 0x1B43, 0), (0x1B6B, 0x1B74, 0), (0x1B80, 0x1B82, 0), (0x1BA2, 0x1BA6, 0),
+    (0x1BA8, 0x1BAA, 0), (0x1C2C, 0x1C34, 0), (0x1C36, 0x1C38, 0), (0x1CD0, 0x1CD3, 0),
+    (0x1CD4, 0x1CE1, 0), (0x1CE2, 0x1CE9, 0), (0x1CED, 0x1CEE, 0), (0x1DC0, 0x1DE7, 0),
+    (0x1DFD, 0x1E00, 0), (0x200B, 0x2010, 0), (0x202A, 0x202F, 0), (0x2060, 0x2065, 0),
+    (0x206A, 0x2070, 0), (0x20D0, 0x20F1, 0), (0x2329, 0x232B, 2), (0x2CEF, 0x2CF2, 0),
+    (0x2DE0, 0x2E00, 0), (0x2E80, 0x2E9A, 2), (0x2E9B, 0x2EF4, 2), (0x2F00, 0x2FD6, 2),
+    (0x2FF0, 0x2FFC, 2), (0x3000, 0x302A, 2), (0x302A, 0x3030, 0), (0x3030, 0x303F, 2),
+    (0x3041, 0x3097, 2), (0x3099, 0x309B, 0), (0x309B, 0x3100, 2), (0x3105, 0x312E, 2),
+    (0x3131, 0x318F, 2), (0x3190, 0x31B8, 2), (0x31C0, 0x31E4, 2), (0x31F0, 0x321F, 2),
+    (0x3220, 0x3248, 2), (0x3250, 0x32FF, 2), (0x3300, 0x4DC0, 2), (0x4E00, 0xA48D, 2),
+    (0xA490, 0xA4C7, 2), (0xA66F, 0xA673, 0), (0xA67C, 0xA67E, 0), (0xA6F0, 0xA6F2, 0),
+    (0xA802, 0xA803, 0), (0xA806, 0xA807, 0), (0xA80B, 0xA80C, 0), (0xA825, 0xA827, 0),
+    (0xA8C4, 0xA8C5, 0), (0xA8E0, 0xA8F2, 0), (0xA926, 0xA92E, 0), (0xA947, 0xA952, 0),
+    (0xA960, 0xA97D, 2), (0xA980, 0xA983, 0), (0xA9B3, 0xA9B4, 0), (0xA9B6, 0xA9BA, 0),
+    (0xA9BC, 0xA9BD, 0), (0xAA29, 0xAA2F, 0), (0xAA31, 0xAA33, 0), (0xAA35, 0xAA37, 0),
+    (0xAA43, 0xAA44, 0), (0xAA4C, 0xAA4D, 0), (0xAAB0, 0xAAB1, 0), (0xAAB2, 0xAAB5, 0),
+    (0xAAB7, 0xAAB9, 0), (0xAABE, 0xAAC0, 0), (0xAAC1, 0xAAC2, 0), (0xABE5, 0xABE6, 0),
+    (0xABE8, 0xABE9, 0), (0xABED, 0xABEE, 0), (0xAC00, 0xD7A4, 2), (0xD7B0, 0xD7C7, 2),
+    (0xD7CB, 0xD7FC, 2), (0xF900, 0xFB00, 2), (0xFB1E, 0xFB1F, 0), (0xFE00, 0xFE10, 0),
+    (0xFE10, 0xFE1A, 2), (0xFE20, 0xFE27, 0), (0xFE30, 0xFE53, 2), (0xFE54, 0xFE67, 2),
+    (0xFE68, 0xFE6C, 2), (0xFEFF, 0xFF00, 0), (0xFF01, 0xFF61, 2), (0xFFE0, 0xFFE7, 2),
+    (0xFFF9, 0xFFFC, 0), (0x101FD, 0x101FE, 0), (0x10A01, 0x10A04, 0), (0x10A05, 0x10A07, 0),
+    (0x10A0C, 0x10A10, 0), (0x10A38, 0x10A3B, 0), (0x10A3F, 0x10A40, 0), (0x11080, 0x11082, 0),
+    (0x110B3, 0x110B7, 0), (0x110B9, 0x110BB, 0), (0x110BD, 0x110BE, 0), (0x1D167, 0x1D16A, 0),
+    (0x1D173, 0x1D183, 0), (0x1D185, 0x1D18C, 0), (0x1D1AA, 0x1D1AE, 0), (0x1D242, 0x1D245, 0),
+    (0x1F200, 0x1F201, 2), (0x1F210, 0x1F232, 2), (0x1F240, 0x1F249, 2), (0x1F300, 0x1F650, 2),
+    (0x1F680, 0x1F700, 2), (0x1F900, 0x1FA00, 2), (0x20000, 0x2FFFE, 2), (0xE0001, 0xE0002, 0),
+    (0xE0020, 0xE0080, 0), (0xE0100, 0xE01F0, 0),
+]
+
+_RUN_STARTS = [start for start, end, width in WIDTH_RUNS]
+
+def _width(cp):
+    idx = bisect.bisect_right(_RUN_STARTS, cp)-1
+    if idx>=0 and cp<WIDTH_RUNS[idx][1]:
+        return WIDTH_RUNS[idx][2]
+    return 1
+
+class _WidthTranslation(dict):
+    """unicode.translate table that turns each code point into as many characters as
+       it is wide (wide ones into two spaces, zero width ones into nothing).
+       Code points are looked up in WIDTH_RUNS the first time they're seen.
+    """
+    def __missing__(self, cp):
+        width = _width(cp)
+        if width==1:
+            value = cp
+        else:
+            value = u" "*width or None
+        self[cp] = value
+        return value
+
+_WIDTH_TRANSLATION = _WidthTranslation()
+
+def display_width(text):
+    """Number of columns text takes up when printed.  About as cheap as len() for ascii"""
+    if not _NON_ASCII_UNICODE.search(text):
+        return len(text)
+    return len(text.translate(_WIDTH_TRANSLATION))
+
+def _is_ascii(text):
+    # -- much quicker than a regex search, when it is ascii
+    try:
+        text.encode('ascii')
+        return True
+    except UnicodeError:
+        return False
+
+# -- display_widths() looks at this many cells at a time
+_BLOCK_CELLS = 64
+
+def display_widths(texts):
+    """display_width() of each of a list of unicode strings, or None if they're
+       all ascii, in which case len() is the width
+    """
+    if _is_ascii(u"".join(texts)):
+        return None
+    # -- Only the non-ascii cells need more than len().  Each block is checked in one go
+    #    first, so a few non-ascii cells in a long column don't cost a check per cell,
+    #    and a column that's mostly non-ascii costs about one extra join
+    widths = map(len, texts)
+    for lo in xrange(0, len(texts), _BLOCK_CELLS):
+        block = texts[lo:lo+_BLOCK_CELLS]
+        if _is_ascii(u"".join(block)):
+            continue
+        for idx, text in enumerate(block, lo):
+            if not _is_ascii(text):
+                widths[idx] = len(text.translate(_WIDTH_TRANSLATION))
+    return widths
+
+if __name__=="__main__":
+    # -- Prints WIDTH_RUNS afresh
+    line = "   "
+    for run in _build_table():
+        item = " (0x%X, 0x%X, %d)," % run
+        if len(line)+len(item)>96:
+            print line
+            line = "   "
+        line += item
+    print line
@@ -1,5 +1,9 @@
 # coding=utf-8
+import sys
+import codecs
 import types
+import itertools
+import threading
 try:
     import chardet
 except ImportError:
@@ -11,15 +15,83 @@ except ImportError:
 #   850 is msdos-latin
 
 DEFAULT_CHARSETS = ['utf-8', 'cp1252', 'mac_roman', '850']
-def _str_2_unicode(data, charsets, encode_errors):
+
+# -- Byte classes used by the sniffer
+_ASCII_BYTES = ''.join([chr(b) for b in range(0x80)])
+_UTF8_CONTINUATION_BYTES = ''.join([chr(b) for b in range(0x80, 0xc0)])
+_UTF8_LEAD2_BYTES = ''.join([chr(b) for b in range(0xc2, 0xe0)])
+_UTF8_LEAD3_BYTES = ''.join([chr(b) for b in range(0xe0, 0xf0)])
+_UTF8_BYTES = (_ASCII_BYTES + _UTF8_CONTINUATION_BYTES + _UTF8_LEAD2_BYTES + 
+               _UTF8_LEAD3_BYTES + ''.join([chr(b) for b in range(0xf0, 0xf5)]))
+
+# -- charset name -> (codec name, bytes it can't decode), bytes is None for
+#    codecs that aren't simple single byte tables (utf-8, utf-16, shift_jis...)
+_CHARSET_CLASSES = {}
+
+def _charset_class(charset):
+    try:
+        return _CHARSET_CLASSES[charset]
+    except KeyError:
+        pass
+    info = codecs.lookup(charset)
+    codec = getattr(info.decode, '__self__', None)
+    module = sys.modules.get(codec.__class__.__module__) if codec is not None else None
+    if info.name in ('ascii', 'iso8859-1') or hasattr(module, 'decoding_table'):
+        bad = []
+        for b in range(256):
+            try:
+                info.decode(chr(b))
+            except UnicodeDecodeError:
+                bad.append(chr(b))
+        result = (info.name, ''.join(bad))
+    else:
+        result = (info.name, None)
+    _CHARSET_CLASSES[charset] = result
+    return result
+
+def _maybe_utf8(high):
+    # -- high is just the non-ascii bytes of the data.  Valid utf-8 needs
+    #    exactly one continuation byte per extra byte of each lead byte
+    if high.translate(None, _UTF8_BYTES):
+        return False
+    leads = high.translate(None, _UTF8_CONTINUATION_BYTES)
+    extra = (len(leads) + len(leads.translate(None, _UTF8_LEAD2_BYTES)) + 
+             len(leads.translate(None, _UTF8_LEAD2_BYTES + _UTF8_LEAD3_BYTES)))
+    return extra==len(high)-len(leads)
+
+def _sniff(data, charsets):
+    """Walk the data once and pick the first charset in charsets that can decode it.
+       Returns (charset, unicode) -- unicode is None when the charset was settled from
+       the byte classes alone, and (None, None) if none of the charsets will do.
+    """
     if not charsets:
         charsets = DEFAULT_CHARSETS
         
+    high = data.translate(None, _ASCII_BYTES)
     for e in charsets:
+        name, bad = _charset_class(e)
+        if bad is not None:
+            if not bad or len(high.translate(None, bad))==len(high):
+                return e, None
+            continue
+        if name=='utf-8' and not _maybe_utf8(high):
+            continue
         try:
-            return unicode(data, e)
+            return e, unicode(data, e)
         except UnicodeDecodeError:
             pass
+    return None, None
+
+def sniff_charset(data, charsets=None):
+    """Returns the charset _str_2_unicode would use to decode data, or None"""
+    return _sniff(data, charsets)[0]
+
+def _decode(data, charsets):
+    charset, udata = _sniff(data, charsets)
+    if udata is not None:
+        return udata
+    if charset:
+        return unicode(data, charset)
     
     if chardet:
         cd = chardet.detect(data)
@@ -31,8 +103,130 @@ def _str_2_unicode(data, charsets, encode_errors):
                 pass
     
     # -- Got here, raise the utf-8 error...
-    return unciode(data, 'utf-8')
+    return unicode(data, 'utf-8')
+    
+DEFAULT_CACHE_ENTRIES = 10000
+DEFAULT_CACHE_BYTES = 16*1024*1024
+
+class DecodeCache(object):
+    """A bounded LRU memo of decoded strings, keyed on the input bytes and charsets.
+
+       Only used by _str_2_unicode when it's turned on, either for the whole process:
+       
+           makeutf8.enable_cache(max_entries=50000)
+           
+       or just for a block, in the thread that runs it:
+       
+           with makeutf8.DecodeCache(max_bytes=1024*1024) as cache:
+               rows = makeutf8.makeItemUTF8(rows)
+           print cache.hits, cache.misses
+           
+       max_bytes limits the total size of the cached input strings (strings bigger
+       than that are never cached).
+    """
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self.clear()
+        
+    def __len__(self):
+        return len(self._links)
+        
+    def clear(self):
+        with self._lock:
+            # -- Circular doubly linked list of [prev, next, key, value], oldest first
+            self._root = root = []
+            root[:] = [root, root, None, None]
+            self._links = {}
+            self.bytes = 0
+        
+    def get(self, key):
+        with self._lock:
+            link = self._links.get(key)
+            if link is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # -- Move it to the newest end
+            prev, next, key, value = link
+            prev[1] = next
+            next[0] = prev
+            root = self._root
+            last = root[0]
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+            return value
+        
+    def put(self, key, value):
+        size = len(key[0])
+        if size>self.max_bytes:
+            return
+        with self._lock:
+            if key in self._links:
+                return
+            root = self._root
+            while self._links and (len(self._links)>=self.max_entries or self.bytes+size>self.max_bytes):
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self._links[oldest[2]]
+                self.bytes -= len(oldest[2][0])
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = self._links[key] = link
+            self.bytes += size
+            
+    def __enter__(self):
+        global _scopes
+        _scope.__dict__.setdefault('caches', []).append(self)
+        with _scopes_lock:
+            _scopes += 1
+        return self
+        
+    def __exit__(self, *args):
+        global _scopes
+        _scope.caches.pop()
+        with _scopes_lock:
+            _scopes -= 1
+        
+# -- The process-wide cache, and each thread's stack of with DecodeCache() blocks,
+#    which come first.  _scopes counts the open blocks in all threads, so without
+#    any the thread local isn't looked at
+_cache = None
+_scope = threading.local()
+_scopes = 0
+_scopes_lock = threading.Lock()
+
+def enable_cache(max_entries=DEFAULT_CACHE_ENTRIES, max_bytes=DEFAULT_CACHE_BYTES):
+    """Turns on the decode cache for the whole process and returns it"""
+    global _cache
+    _cache = DecodeCache(max_entries, max_bytes)
+    return _cache
     
+def disable_cache():
+    global _cache
+    _cache = None
+
+def _str_2_unicode(data, charsets, encode_errors):
+    cache = _cache
+    if _scopes:
+        caches = getattr(_scope, 'caches', None)
+        if caches:
+            cache = caches[-1]
+    if cache is None or not cache.max_entries:
+        return _decode(data, charsets)
+    key = (data, tuple(charsets or ()))
+    udata = cache.get(key)
+    if udata is None:
+        udata = _decode(data, charsets)
+        cache.put(key, udata)
+    return udata
+
 def make_unicode(data, charsets=None, encode_errors=None):
     # If it's not already a str, we can safely unicode-ify it
     if not isinstance(data, str):
@@ -48,50 +242,478 @@ def makeUTF8(data, charsets=None, encode_errors='ignore'):
     
     if isinstance(data, str):
         data = _str_2_unicode(data, charsets, encode_errors)        
-    return data.encode("utf-8", encode_errors)    
+    return data.encode("utf-8", encode_errors)
 
-def _make_item(func, i):
-    if isinstance(i, dict):
-        return _make_dict(func, i)
-    elif isinstance(i, basestring):
-        return func(i)
-    elif isinstance(i, tuple):
-        return _make_tuple(func, i)
-    elif isinstance(i, list):
-        return _make_list(func, i)
-    else:
+DEFAULT_CHUNK_SIZE = 64*1024
+
+def _utf8_tail_len(data):
+    # -- Number of bytes at the end of data that start a utf-8 sequence
+    #    which the next chunk might complete
+    for i in range(1, min(len(data), 3)+1):
+        b = ord(data[-i])
+        if b<0x80:
+            return 0
+        if b>=0xc0:
+            if b<0xe0:
+                need = 2
+            elif b<0xf0:
+                need = 3
+            else:
+                need = 4
+            return i if need>i else 0
+    return 0
+
+class IncrementalCharsetDecoder(object):
+    """Decodes a byte stream a chunk at a time.
+
+       The charset is sniffed from the first chunk.  If a later chunk won't decode,
+       whatever decodes is kept and the decoder falls forward through the rest of
+       charsets, so data that has already been returned is never looked at again.
+    """
+    def __init__(self, charsets=None):
+        self.charsets = list(charsets or DEFAULT_CHARSETS)
+        self.charset = None
+        self.fallbacks = 0
+        self._decoder = None
+        
+    def _start(self, charset):
+        self.charset = charset
+        self._decoder = codecs.getincrementaldecoder(charset)()
+        
+    def decode(self, data, final=False):
+        if self._decoder is None:
+            if not data and not final:
+                return u""
+            tail = 0 if final else _utf8_tail_len(data)
+            charset = _sniff(data[:len(data)-tail], self.charsets)[0]
+            # -- Nothing sniffs clean: start at the top and let the fallbacks sort it out
+            self._start(charset or self.charsets[0])
+            
+        try:
+            return self._decoder.decode(data, final)
+        except UnicodeDecodeError, e:
+            pending = self._decoder.getstate()[0] + data
+            
+        # -- pending already has the bytes the decoder was holding on to
+        self._decoder.reset()
+        out = self._decoder.decode(pending[:e.start])
+        rest = pending[e.start:]
+        idx = self.charsets.index(self.charset)
+        for charset in self.charsets[idx+1:]:
+            decoder = codecs.getincrementaldecoder(charset)()
+            try:
+                out += decoder.decode(rest, final)
+            except UnicodeDecodeError:
+                continue
+            self.charset = charset
+            self._decoder = decoder
+            self.fallbacks += 1
+            return out
+        raise e
+        
+def _iter_chunks(source, chunk_size):
+    if hasattr(source, 'read'):
+        return iter(lambda: source.read(chunk_size), '')
+    return iter(source)
+
+def iter_unicode(source, charsets=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields unicode chunks for a file-like object or an iterator of byte chunks"""
+    decoder = IncrementalCharsetDecoder(charsets)
+    for chunk in _iter_chunks(source, chunk_size):
+        udata = decoder.decode(chunk)
+        if udata:
+            yield udata
+    udata = decoder.decode('', True)
+    if udata:
+        yield udata
+
+def iterUTF8(source, charsets=None, encode_errors='ignore', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields utf-8 chunks for a file-like object or an iterator of byte chunks"""
+    for udata in iter_unicode(source, charsets, chunk_size):
+        yield udata.encode("utf-8", encode_errors)
+
+def _utf8_ranges(data, block_size=DEFAULT_CHUNK_SIZE):
+    """Yields (start, end, is_valid) for the runs of valid and invalid utf-8 in data,
+       which can be a str or anything else with the buffer interface (e.g. an mmap).
+       No range is longer than block_size.
+    """
+    size = len(data)
+    block_size = max(block_size, 4)
+    pos = 0
+    bad_start = None
+    while pos<size:
+        window = buffer(data, pos, block_size)
+        final = pos+len(window)>=size
+        try:
+            end = next_pos = pos+codecs.utf_8_decode(window, 'strict', final)[1]
+            is_error = False
+        except UnicodeDecodeError, e:
+            end = pos+e.start
+            next_pos = pos+e.end
+            is_error = True
+        if end>pos:
+            if bad_start is not None:
+                yield bad_start, pos, False
+                bad_start = None
+            yield pos, end, True
+        if is_error and bad_start is None:
+            bad_start = end
+        pos = next_pos
+    if bad_start is not None:
+        yield bad_start, size, False
+
+def _repair_charsets(charsets):
+    return [c for c in (charsets or DEFAULT_CHARSETS) if _charset_class(c)[0]!='utf-8']
+
+def iter_repaired_utf8(data, charsets=None, block_size=DEFAULT_CHUNK_SIZE):
+    """Yields utf-8 chunks for data that mixes utf-8 with other charsets.
+    
+       Valid utf-8 is passed through untouched, and only the byte ranges that aren't
+       valid utf-8 are decoded, using the rest of charsets.
+    """
+    repair_charsets = _repair_charsets(charsets)
+    for start, end, is_valid in _utf8_ranges(data, block_size):
+        if is_valid:
+            yield data[start:end]
+        else:
+            yield _str_2_unicode(data[start:end], repair_charsets, None).encode("utf-8")
+
+def repair_utf8(data, charsets=None):
+    """Returns data as utf-8, decoding only the parts that aren't already utf-8"""
+    if not isinstance(data, str):
+        return makeUTF8(data, charsets)
+    return "".join(iter_repaired_utf8(data, charsets))
+
+DEFAULT_SAMPLE_SIZE = 100
+
+class BatchConverter(object):
+    """Converts lots of strings from the same feed.
+
+       The first sample_size items go through the full charset cascade, and the
+       charset most of the non-ascii ones needed is tried first for everything after
+       that.  Items the learned charset can't decode go through the cascade and are
+       counted in fallbacks.  Single byte charsets decode (nearly) any bytes, so when
+       one is learned, items that look like utf-8 go through the cascade (and count)
+       too.
+
+       Example:
+           bc = makeutf8.BatchConverter()
+           rows = [bc.makeUTF8(f) for f in fields]
+           print bc.charset, bc.fallbacks
+    """
+    def __init__(self, charsets=None, sample_size=DEFAULT_SAMPLE_SIZE, encode_errors='ignore'):
+        self.charsets = charsets
+        self.sample_size = sample_size
+        self.encode_errors = encode_errors
+        self.charset = None
+        self._single_byte = False
+        self.sampled = 0
+        self.fallbacks = 0
+        self.charset_counts = {}
+        
+    def _learn(self, data):
+        charset, udata = _sniff(data, self.charsets)
+        if charset and data.translate(None, _ASCII_BYTES):
+            self.charset_counts[charset] = self.charset_counts.get(charset, 0) + 1
+        self.sampled += 1
+        if self.sampled>=self.sample_size and self.charset_counts:
+            self.charset = max(self.charset_counts.items(), key=lambda (k, v): v)[0]
+            self._single_byte = _charset_class(self.charset)[1] is not None
+        if udata is not None:
+            return udata
+        if charset:
+            return unicode(data, charset)
+        return _str_2_unicode(data, self.charsets, self.encode_errors)
+        
+    def _str_2_unicode(self, data):
+        if self.charset is None:
+            # -- Still learning; all-ascii samples don't count, so keep going until one does
+            return self._learn(data)
+        if self._single_byte:
+            high = data.translate(None, _ASCII_BYTES)
+            if high and _maybe_utf8(high):
+                self.fallbacks += 1
+                return _str_2_unicode(data, self.charsets, self.encode_errors)
+        try:
+            return unicode(data, self.charset)
+        except UnicodeDecodeError:
+            self.fallbacks += 1
+            return _str_2_unicode(data, self.charsets, self.encode_errors)
+            
+    def make_unicode(self, data):
+        if not isinstance(data, str):
+            return unicode(data)
+        return self._str_2_unicode(data)
+            
+    def makeUTF8(self, data):
+        if not isinstance(data, basestring):
+            return data
+        if isinstance(data, str):
+            data = self._str_2_unicode(data)
+        return data.encode("utf-8", self.encode_errors)
+
+    def iter_unicode(self, items):
+        for i in items:
+            yield self.make_unicode(i)
+
+    def iterUTF8(self, items):
+        for i in items:
+            yield self.makeUTF8(i)
+
+# -- Converting nested containers.  The containers are walked with an explicit
+#    stack rather than by recursion, so deep data can't hit the recursion limit.
+#    Containers are memoized by id(), so shared (and cyclic) parts are converted
+#    once, and a container with nothing to convert in it is returned as is rather
+#    than copied.  With in_place, lists, dicts and sets are updated instead of copied.
+#    Generators and other iterators are wrapped so their items are converted as
+#    they're consumed.
+
+class _ListFrame(object):
+    def __init__(self, obj, in_place, memo):
+        self.obj = obj
+        self.in_place = in_place
+        self.children = iter(obj)
+        self.changed = False
+        self.idx = 0
+        if in_place:
+            self.new = obj
+        else:
+            self.new = []
+        memo[id(obj)] = self.new
+            
+    def add(self, old, new):
+        if new is not old:
+            if self.in_place:
+                self.obj[self.idx] = new
+            elif not self.changed:
+                self.new.extend(self.obj[:self.idx])
+            self.changed = True
+        if self.changed and not self.in_place:
+            self.new.append(new)
+        self.idx += 1
+        
+    def finish(self):
+        if self.changed:
+            return self.new
+        return self.obj
+        
+class _TupleFrame(object):
+    def __init__(self, obj, in_place, memo):
+        self.obj = obj
+        self.children = iter(obj)
+        self.changed = False
+        self.items = []
+        # -- A tuple can't exist until its items do, so a cycle back to a tuple
+        #    that's still being converted gets the original
+        memo[id(obj)] = obj
+        
+    def add(self, old, new):
+        if new is not old:
+            self.changed = True
+        self.items.append(new)
+        
+    def finish(self):
+        if self.changed:
+            return tuple(self.items)
+        return self.obj
+        
+class _DictFrame(object):
+    def __init__(self, obj, in_place, memo):
+        self.obj = obj
+        self.in_place = in_place
+        self.children = itertools.chain.from_iterable(obj.iteritems())
+        self.changed = False
+        self.key = None
+        self.renames = []
+        if in_place:
+            self.new = obj
+        else:
+            self.new = {}
+        memo[id(obj)] = self.new
+        
+    def add(self, old, new):
+        if self.key is None:
+            self.key = (old, new)
+            return
+        (old_key, key), self.key = self.key, None
+        if key is old_key and new is old:
+            return
+        if self.in_place:
+            if key is old_key:
+                self.obj[key] = new
+            else:
+                # -- Can't re-key a dict while iterating over it
+                self.renames.append((old_key, key, new))
+        else:
+            if not self.changed:
+                self.new.update(self.obj)
+            if key is not old_key:
+                del self.new[old_key]
+            self.new[key] = new
+        self.changed = True
+        
+    def finish(self):
+        for old_key, key, value in self.renames:
+            del self.obj[old_key]
+        for old_key, key, value in self.renames:
+            self.obj[key] = value
+        if self.changed:
+            return self.new
+        return self.obj
+
+class _NamedTupleFrame(_TupleFrame):
+    def finish(self):
+        if self.changed:
+            return self.obj._make(self.items)
+        return self.obj
+
+class _SetFrame(object):
+    def __init__(self, obj, in_place, memo):
+        self.obj = obj
+        self.in_place = in_place and isinstance(obj, set)
+        self.children = iter(obj)
+        self.changed = False
+        self.items = []
+        memo[id(obj)] = obj
+        
+    def add(self, old, new):
+        if new is not old:
+            self.changed = True
+        self.items.append(new)
+        
+    def finish(self):
+        if not self.changed:
+            return self.obj
+        if self.in_place:
+            # -- Can't change a set while iterating over it
+            self.obj.clear()
+            self.obj.update(self.items)
+            return self.obj
+        if isinstance(self.obj, frozenset):
+            return frozenset(self.items)
+        return set(self.items)
+
+# -- Markers for the non-container handlers
+_STRING = "string"
+_LAZY = "lazy"
+
+# -- type -> handler: a frame class, _STRING, _LAZY or None (left alone).
+#    Other types are looked up by their base classes the first time they're seen.
+_HANDLERS = {str: _STRING,
+             unicode: _STRING,
+             int: None,
+             long: None,
+             float: None,
+             bool: None,
+             types.NoneType: None,
+             dict: _DictFrame,
+             list: _ListFrame,
+             tuple: _TupleFrame,
+             set: _SetFrame,
+             frozenset: _SetFrame,
+             types.GeneratorType: _LAZY,
+             }
+
+def _find_handler(t):
+    if t is types.InstanceType:
+        # -- Old-style class instances all share this one type, so they're left alone
+        return None
+    if issubclass(t, basestring):
+        return _STRING
+    if issubclass(t, tuple) and hasattr(t, '_make') and hasattr(t, '_fields'):
+        return _NamedTupleFrame
+    for base in t.__mro__[1:]:
+        if base in (dict, list, tuple, set, frozenset):
+            return _HANDLERS[base]
+    # -- Iterators are converted as they're consumed.  Files (anything with a
+    #    read or write) are iterators too, but wrapping them would just get in the way
+    if (callable(getattr(t, 'next', None)) and callable(getattr(t, '__iter__', None)) and
+        not hasattr(t, 'read') and not hasattr(t, 'write')):
+        return _LAZY
+    return None
+
+def _handler(i):
+    t = type(i)
+    try:
+        return _HANDLERS[t]
+    except KeyError:
+        handler = _HANDLERS[t] = _find_handler(t)
+        return handler
+
+def _make_lazy(func, items, in_place):
+    # -- Each item gets its own memo, since earlier ones may be long gone
+    for i in items:
+        yield _make_item(func, i, in_place)
+
+def _make_item(func, i, in_place=False):
+    handler = _handler(i)
+    if handler is None:
         return i
+    elif handler is _STRING:
+        return func(i)
+    elif handler is _LAZY:
+        return _make_lazy(func, i, in_place)
+    
+    memo = {}
+    stack = [handler(i, in_place, memo)]
+    while True:
+        frame = stack[-1]
+        for child in frame.children:
+            handler = _handler(child)
+            if handler is None:
+                frame.add(child, child)
+            elif handler is _STRING:
+                frame.add(child, func(child))
+            elif handler is _LAZY:
+                frame.add(child, _make_lazy(func, child, in_place))
+            elif id(child) in memo:
+                frame.add(child, memo[id(child)])
+            else:
+                stack.append(handler(child, in_place, memo))
+                break
+        else:
+            stack.pop()
+            new = frame.finish()
+            memo[id(frame.obj)] = new
+            if not stack:
+                return new
+            stack[-1].add(frame.obj, new)
 
-def _make_dict(func, d):
-    return dict([(_make_item(func, k), _make_item(func, v)) for k,v in d.items()])
+def _make_dict(func, d, in_place=False):
+    if not isinstance(d, dict):
+        d = dict(d.items())
+    return _make_item(func, d, in_place)
 
 def _make_tuple(func, t):
-    return tuple(_make_list(func, t))
+    return _make_item(func, tuple(t))
 
-def _make_list(func, l):
-    return [_make_item(func, i) for i in l]
+def _make_list(func, l, in_place=False):
+    if not isinstance(l, list):
+        l = list(l)
+    return _make_item(func, l, in_place)
 
 # Helpers to convert strings in common python objects into either utf-8 or unicode
-def makeItemUTF8(i):
-    return _make_item(makeUTF8, i)
+# in_place=True updates lists and dicts rather than copying them
+def makeItemUTF8(i, in_place=False):
+    return _make_item(makeUTF8, i, in_place)
 
-def makeDictUTF8(d):
-    return _make_dict(makeUTF8, d) 
+def makeDictUTF8(d, in_place=False):
+    return _make_dict(makeUTF8, d, in_place) 
 
 def makeTupleUTF8(t):
     return _make_tuple(makeUTF8, t)
 
-def makeListUTF8(l):
-    return _make_list(makeUTF8, t)
+def makeListUTF8(l, in_place=False):
+    return _make_list(makeUTF8, l, in_place)
 
-def make_unicode_item(i):
-    return _make_item(make_unicode, i)
+def make_unicode_item(i, in_place=False):
+    return _make_item(make_unicode, i, in_place)
 
-def make_unicode_dict(d):
-    return _make_dict(make_unicode, d) 
+def make_unicode_dict(d, in_place=False):
+    return _make_dict(make_unicode, d, in_place) 
 
 def make_unicode_tuple(t):
     return _make_tuple(make_unicode, t)
 
-def make_unicode_list(l):
-    return _make_list(make_unicode, t)
+def make_unicode_list(l, in_place=False):
+    return _make_list(make_unicode, l, in_place)
@@ -1,25 +1,46 @@
 import sys
-import codecs
+import time
 import locale
-import stdwrapper
-import anglicize
+import cPickle
+import collections
+import itertools
+import tempfile
+import multiprocessing
+import makeutf8
+import displaywidth
 
-def sprint_rows_as_text(*args, **kwargs):
-    stw = stdwrapper.StdWrapper()
-    try:
-        _print_rows_as_text(*args, **kwargs)
-    finally:
-        sout, serr = stw.done()
-    return sout
+WRITE_BATCH_ROWS = 1000
+
+def render_rows_as_text(rows, out=None, first_is_header=True, col_lens=None, formats=None, encoding=None):
+    """Renders rows as a text table.  Each line ends with a newline.
+       
+       out      - a file object to write the table to; if None the table is returned
+                  as one unicode string (joined once from the rendered chunks)
+       encoding - if given, what's written to out is encoded with it first
+    """
+    return _render(_iter_table_lines(rows, first_is_header, col_lens, formats), out, encoding)
 
-def print_rows_as_text(*args, **kwargs):
+def sprint_rows_as_text(rows, first_is_header=True, col_lens=None, formats=None):
+    return render_rows_as_text(rows, None, first_is_header, col_lens, formats)
+
+def print_rows_as_text(rows, first_is_header=True, col_lens=None, formats=None):
     # Convert to preferred encoding to prevent UnicodeDecode errors when printing to stdout
-    saved_sout = sys.stdout
-    try:
-        sys.stdout = codecs.getwriter(locale.getpreferredencoding())(sys.stdout)
-        _print_rows_as_text(*args, **kwargs)
-    finally:
-        sys.stdout = saved_sout
+    render_rows_as_text(rows, sys.stdout, first_is_header, col_lens, formats, locale.getpreferredencoding())
+
+def _render(lines, out, encoding=None):
+    if out is None:
+        text = u"".join(lines)
+        if encoding:
+            text = text.encode(encoding)
+        return text
+    # -- Written a batch of lines at a time, so the encode and write calls stay few
+    while True:
+        chunk = u"".join(itertools.islice(lines, WRITE_BATCH_ROWS))
+        if not chunk:
+            break
+        if encoding:
+            chunk = chunk.encode(encoding)
+        out.write(chunk)
         
 def _wrap_row(in_row):
     out_rows = [[],]
@@ -43,61 +64,481 @@ def _wrap_rows(in_rows):
         out_rows.extend(_wrap_row(row))
     return out_rows
 
+def _cell_text(f):
+    # -- The string a cell is printed as.  unicode() covers unicode, ascii str and
+    #    numbers, which is nearly everything
+    try:
+        return unicode(f)
+    except UnicodeDecodeError:
+        if not isinstance(f, str):
+            f = str(f)
+        return makeutf8.make_unicode(f)
 
-def _calc_col_lens(rows, col_lens):
-    if not rows:
-        return col_lens
-    
-    def _str(f):
-        try:
-            return str(f)
-        except:
-            return anglicize.anglicize(f)
+class _Cells(object):
+    """A batch of (wrapped) rows, turned into the strings they're printed as just once,
+       and held by column along with each column's width.
+       
+       raw - keep the original values to print rather than the strings, for callers'
+             formats that need them (e.g. "%%%s.2f")
+    """
+    def __init__(self, rows, raw=False):
+        if raw:
+            rows = _wrap_rows(rows)
+        elif not isinstance(rows, list):
+            rows = list(rows)
+        columns = [map(_cell_text, col) for col in itertools.izip_longest(*rows, fillvalue=u"")]
+        if not raw:
+            for col in columns:
+                if u"\n" in u"".join(col):
+                    rows = _wrap_rows(itertools.izip(*columns))
+                    columns = [list(col) for col in itertools.izip_longest(*rows, fillvalue=u"")]
+                    break
+        self._measure(columns)
+        self.num_rows = len(rows)
+        if raw:
+            self.rows = rows
+            self.columns = None
+        else:
+            self.rows = None
+            self.columns = columns
+
+    @classmethod
+    def from_columns(cls, columns, widths=None):
+        """_Cells for columns of strings (all the same length) that are already made.
+           widths - any widths that are already known, None for the rest
+        """
+        self = cls.__new__(cls)
+        self._measure(columns, widths)
+        self.num_rows = len(columns[0]) if columns else 0
+        self.rows = None
+        self.columns = columns
+        return self
+
+    def _measure(self, columns, widths=None):
+        self.widths = []
+        # -- {row index: [len() less display width, for each column]}, for the rows
+        #    with wide or zero width characters
+        self.extras = {}
+        for col_idx, col in enumerate(columns):
+            if widths and widths[col_idx] is not None:
+                self.widths.append(widths[col_idx])
+                continue
+            col_widths = displaywidth.display_widths(col)
+            if col_widths is None:
+                self.widths.append(max(itertools.imap(len, col)) if col else 0)
+                continue
+            self.widths.append(max(col_widths))
+            for row_idx, (text, width) in enumerate(itertools.izip(col, col_widths)):
+                if width!=len(text):
+                    self.extras.setdefault(row_idx, [0]*len(columns))[col_idx] = len(text)-width
         
-    if not col_lens:        
-        col_lens = [len(_str(f)) for f in rows[0]]
+    def __len__(self):
+        return self.num_rows
         
-    for row in rows:
-        row_lens = [len(_str(f)) for f in row]
-        col_lens = [max(f, r) for f, r in map(None, col_lens, row_lens)]
+    def __iter__(self):
+        if self.columns is None:
+            rows = iter(self.rows)
+        else:
+            rows = itertools.izip(*self.columns)
+        if self.extras:
+            return self._iter_wide(rows)
+        return rows
+
+    def _iter_wide(self, rows):
+        for idx, row in enumerate(rows):
+            if idx in self.extras:
+                yield _WideRow(row, self.extras[idx])
+            else:
+                yield row
 
-    return col_lens
+class _WideRow(tuple):
+    """A row whose cells' display widths aren't their len()s.  extras is len() less
+       the display width for each cell, which their padding has to make up for
+    """
+    def __new__(cls, row, extras):
+        self = tuple.__new__(cls, row)
+        self.extras = extras
+        return self
+
+def _iter_cells(rows, batch_size, raw=False):
+    rows = iter(rows)
+    while True:
+        cells = _Cells(itertools.islice(rows, batch_size), raw)
+        if not cells:
+            break
+        yield cells
+
+def _merge_col_lens(col_lens, widths):
+    if not col_lens:
+        return list(widths)
+    return [max(f, r) for f, r in itertools.izip_longest(col_lens, widths, fillvalue=0)]
+
+def _calc_col_lens(rows, col_lens):
+    if not rows:
+        return col_lens
+    return _merge_col_lens(col_lens, _Cells(rows).widths)
 
-def _print_row_as_text(row, fmt):
+def _format_row(row, fmt):
     try:
-        out = fmt % tuple(row)
-        print out.rstrip()
+        return (fmt % tuple(row)).rstrip() + u"\n"
     except:
-        print "FMT: %r" % fmt
-        print "ROW: %r" % row
+        print >>sys.stderr, "FMT: %r" % fmt
+        print >>sys.stderr, "ROW: %r" % (row,)
         raise
         
-def _print_rows_as_text(rows, first_is_header=True, col_lens=None, formats=None):
+def _make_fmt(col_lens, formats):
+    if not formats:
+        formats = [u"%%-%ss" for f in col_lens]
+        
+    return u"  ".join([f % l for l, f in map(None, col_lens, formats)])
+
+def _wide_fmt(row, col_lens, formats):
+    return _make_fmt([l+e for l, e in itertools.izip_longest(col_lens, row.extras, fillvalue=0)], formats)
+
+def _format_rows(rows, fmt, col_lens, formats):
+    for row in rows:
+        if row.__class__ is _WideRow:
+            yield _format_row(row, _wide_fmt(row, col_lens, formats))
+        else:
+            yield _format_row(row, fmt)
+
+def _iter_table(header_rows, body_rows, col_lens, formats):
+    fmt = _make_fmt(col_lens, formats)
+    if not header_rows:
+        return _format_rows(body_rows, fmt, col_lens, formats)
+    return itertools.chain(_format_rows(header_rows, fmt, col_lens, formats),
+                           [_format_row([u"="*f for f in col_lens], fmt)],
+                           _format_rows(body_rows, fmt, col_lens, formats))
+        
+def _iter_table_lines(rows, first_is_header=True, col_lens=None, formats=None):
     if not rows:
-        return
+        return iter([])
     
+    raw = bool(formats)
     if first_is_header:
-        header_rows = _wrap_rows(rows[:1])
-        body_rows = _wrap_rows(rows[1:])        
+        header_rows = _Cells(rows[:1], raw)
+        body_rows = _Cells(itertools.islice(rows, 1, None), raw)
     else:
         header_rows = []
-        body_rows = _wrap_rows(rows)
+        body_rows = _Cells(rows, raw)
 
     if not col_lens:
-        col_lens = _calc_col_lens(header_rows, [])
-        col_lens = _calc_col_lens(body_rows, col_lens)
+        col_lens = _merge_col_lens([], body_rows.widths)
+        if header_rows:
+            col_lens = _merge_col_lens(header_rows.widths, col_lens)
 
-    if not formats:
-        formats = [u"%%-%ss" for f in col_lens]
-        
-    fmt = u"  ".join([f % l for l, f in map(None, col_lens, formats)])
-    if header_rows:
-        for row in header_rows:
-            _print_row_as_text(row, fmt)
-        _print_row_as_text([u"="*f for f in col_lens], fmt)
-
-    for row in body_rows:
-        _print_row_as_text(row, fmt)
-    #print fmt
+    return _iter_table(header_rows, body_rows, col_lens, formats)
+
+DEFAULT_SAMPLE_ROWS = 1000
+SPOOL_MEMORY_SIZE = 10*1024*1024
+
+def _spool_cells(batches, col_lens):
+    """Writes batches of _Cells to a temporary file, working out col_lens on the way.
+       Returns (spool, col_lens) -- use _unspool_cells() to read them back
+    """
+    spool = tempfile.SpooledTemporaryFile(SPOOL_MEMORY_SIZE)
+    for cells in batches:
+        col_lens = _merge_col_lens(col_lens, cells.widths)
+        cPickle.dump(cells, spool, cPickle.HIGHEST_PROTOCOL)
+    spool.seek(0)
+    return spool, col_lens
+
+def _unspool_cells(spool):
+    try:
+        while True:
+            try:
+                yield cPickle.load(spool)
+            except EOFError:
+                break
+    finally:
+        spool.close()
+
+DEFAULT_STREAM_BATCH_ROWS = WRITE_BATCH_ROWS
+DEFAULT_STREAM_FLUSH_INTERVAL = 0.1 # seconds
+
+def _stream_lines(rows, raw, fmt, col_lens, formats):
+    """The lines for rows once fmt is fixed.  Each row is formatted by itself, without
+       the batching a _Cells does to find the widths
+    """
+    num_cols = len(col_lens)
+    for row in rows:
+        if raw:
+            wrapped = _wrap_row(row)
+        else:
+            texts = map(_cell_text, row)
+            wrapped = _wrap_row(texts) if u"\n" in u"".join(texts) else [texts]
+        for cells in wrapped:
+            if len(cells)<num_cols:
+                cells = list(cells)+[u""]*(num_cols-len(cells))
+            texts = map(_cell_text, cells) if raw else cells
+            widths = displaywidth.display_widths(texts)
+            if widths is None:
+                yield _format_row(cells, fmt)
+            else:
+                wide = _WideRow(cells, [len(t)-w for t, w in itertools.izip(texts, widths)])
+                yield _format_row(wide, _wide_fmt(wide, col_lens, formats))
+
+def _write_streamed(lines, out, encoding, batch_rows, flush_interval):
+    # -- Written (and flushed) once batch_rows lines are waiting, or flush_interval has
+    #    passed since the last write, so a slow feed still shows up as it comes
+    pending = []
+    next_write = time.time()+flush_interval
+    for line in lines:
+        pending.append(line)
+        if len(pending)>=batch_rows or time.time()>=next_write:
+            _write_lines(pending, out, encoding)
+            pending = []
+            next_write = time.time()+flush_interval
+    _write_lines(pending, out, encoding)
+
+def _write_lines(lines, out, encoding):
+    text = u"".join(lines)
+    if text:
+        out.write(text.encode(encoding) if encoding else text)
+        out.flush()
+
+def stream_rows_as_text(rows, first_is_header=True, col_lens=None, formats=None, 
+                        sample_size=DEFAULT_SAMPLE_ROWS, exact=False, out=None, encoding=None,
+                        batch_rows=DEFAULT_STREAM_BATCH_ROWS, flush_interval=DEFAULT_STREAM_FLUSH_INTERVAL):
+    """Like print_rows_as_text, but rows can be any iterable, and rows are printed as they come.
+
+       out            - a file object to write to instead of stdout; encoding as for
+                        render_rows_as_text (stdout gets the preferred encoding)
+
+       col_lens       - if given, rows are written as they come (after the header row)
+       exact          - if True, rows are spooled to a temporary file to get exact column
+                        widths, then printed from there
+       sample_size    - otherwise, the widths come from the first sample_size rows, and
+                        any wider values after that just push their line out
+       batch_rows     - lines are written (and out flushed) once batch_rows are waiting
+       flush_interval - ... or once flush_interval seconds have passed since the last write.
+                        It's checked as each row comes in, so if rows stop coming the last
+                        few wait for the next one; 0 writes each row as it comes
+    """
+    rows = iter(rows)
+    raw = bool(formats)
+    if first_is_header:
+        header_rows = _Cells(itertools.islice(rows, 1), raw)
+        header_lens = header_rows.widths
+    else:
+        header_rows = []
+        header_lens = []
     
-        
\ No newline at end of file
+    batches = None
+    if col_lens:
+        first_rows = []
+    elif exact:
+        first_rows = []
+        spool, col_lens = _spool_cells(_iter_cells(rows, DEFAULT_SAMPLE_ROWS, raw), header_lens)
+        batches = _unspool_cells(spool)
+    else:
+        first_rows = _Cells(itertools.islice(rows, sample_size), raw)
+        col_lens = _merge_col_lens(header_lens, first_rows.widths)
+        
+    if not header_rows and not first_rows and not col_lens:
+        return
+    if out is None:
+        out = sys.stdout
+        encoding = encoding or locale.getpreferredencoding()
+    fmt = _make_fmt(col_lens, formats)
+    _write_lines(_iter_table(header_rows, first_rows, col_lens, formats), out, encoding)
+    if batches is None:
+        _write_streamed(_stream_lines(rows, raw, fmt, col_lens, formats), out, encoding, batch_rows, flush_interval)
+    else:
+        # -- Spooled, so they're all here already
+        for cells in batches:
+            _write_lines(_format_rows(cells, fmt, col_lens, formats), out, encoding)
+
+PARALLEL_CHUNK_ROWS = 20000
+
+# -- The rows being rendered, in each worker.  Handed over by the pool's initializer,
+#    which costs nothing where workers are forked, so jobs are just slice bounds
+_POOL_ROWS = None
+
+def _set_pool_rows(rows):
+    global _POOL_ROWS
+    _POOL_ROWS = rows
+
+def _iter_chunks(start, end, chunk_rows, *args):
+    for idx in xrange(start, end, chunk_rows):
+        yield (idx, min(idx+chunk_rows, end))+args
+
+def _chunk_widths(args):
+    start, end, raw = args
+    return _Cells(_POOL_ROWS[start:end], raw).widths
+
+def _render_chunk(args):
+    start, end, raw, col_lens, formats = args
+    return u"".join(_iter_table([], _Cells(_POOL_ROWS[start:end], raw), col_lens, formats))
+
+def render_rows_in_parallel(rows, out=None, first_is_header=True, col_lens=None, formats=None, encoding=None,
+                            jobs=None, chunk_rows=PARALLEL_CHUNK_ROWS):
+    """Like render_rows_as_text, but rows are split into chunks of chunk_rows, which are
+       sized and then formatted on a pool of jobs worker processes [one per cpu].
+       The chunks are put back in order.  For very big tables -- rows must be a
+       sequence, and where workers aren't forked (Windows) they have to pickle.
+    """
+    if not rows:
+        return u"" if out is None else None
+    raw = bool(formats)
+    if first_is_header:
+        header_rows = _Cells(rows[:1], raw)
+        start = 1
+    else:
+        header_rows = []
+        start = 0
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs==1:
+        pool = None
+        imap = imap_unordered = itertools.imap
+        _set_pool_rows(rows)
+    else:
+        pool = multiprocessing.Pool(jobs, _set_pool_rows, (rows,))
+        imap, imap_unordered = pool.imap, pool.imap_unordered
+    try:
+        if not col_lens:
+            col_lens = header_rows.widths if header_rows else []
+            for widths in imap_unordered(_chunk_widths, _iter_chunks(start, len(rows), chunk_rows, raw)):
+                col_lens = _merge_col_lens(col_lens, widths)
+
+        lines = itertools.chain(_iter_table(header_rows, [], col_lens, formats),
+                                imap(_render_chunk, _iter_chunks(start, len(rows), chunk_rows, raw, col_lens, formats)))
+        if out is None:
+            text = u"".join(lines)
+            return text.encode(encoding) if encoding else text
+        for chunk in lines:
+            out.write(chunk.encode(encoding) if encoding else chunk)
+    finally:
+        if pool is None:
+            _set_pool_rows(None)
+        else:
+            pool.close()
+            pool.join()
+
+DEFAULT_FLOAT_PRECISION = 2
+
+_NUMBER_TYPES = set([int, long])
+_FLOAT_TYPES = set([int, long, float])
+
+def _column_texts(values, float_precision):
+    """Returns (texts, width or None if not known yet, is_number) for one column"""
+    float_fmt = u"%%.%sf" % float_precision
+    if hasattr(values, 'dtype') and hasattr(values, 'shape'):
+        # -- NumPy array: numbers are turned into strings and measured a column at a time
+        kind = values.dtype.kind
+        if kind in 'iuf':
+            import numpy
+            if kind=='f':
+                texts = numpy.char.mod(float_fmt, values)
+            else:
+                texts = values.astype(unicode)
+            width = int(numpy.char.str_len(texts).max()) if len(texts) else 0
+            return texts.tolist(), width, True
+        values = values.tolist()
+    types = set(itertools.imap(type, values))
+    if types and types<=_NUMBER_TYPES:
+        return map(unicode, values), None, True
+    if float in types and types<=_FLOAT_TYPES:
+        return [float_fmt % v for v in values], None, True
+    return map(_cell_text, values), None, False
+
+def render_columns_as_text(columns, out=None, names=None, header=True, float_precision=DEFAULT_FLOAT_PRECISION, encoding=None):
+    """Renders a table given by column rather than by row: a dict of name: values, or a
+       NumPy structured array.  Numbers are right aligned, and floats are shown to
+       float_precision places.  Each line is only made as it's written; out and encoding
+       are as for render_rows_as_text.
+
+       names - the columns to show, in order [the array's fields, or the dict's keys, in
+               order for an OrderedDict, otherwise sorted]
+    """
+    if names is None:
+        if hasattr(columns, 'dtype'):
+            names = columns.dtype.names
+        elif isinstance(columns, collections.OrderedDict):
+            names = columns.keys()
+        else:
+            names = sorted(columns.keys())
+    if not names:
+        return _render(iter([]), out, encoding)
+    texts, widths, formats = [], [], []
+    for name in names:
+        col_texts, width, is_number = _column_texts(columns[name], float_precision)
+        texts.append(col_texts)
+        widths.append(width)
+        formats.append(u"%%%ss" if is_number else u"%%-%ss")
+    num_rows = max([len(col) for col in texts] or [0])
+    for col_idx, col in enumerate(texts):
+        if len(col)<num_rows:
+            texts[col_idx] = col+[u""]*(num_rows-len(col))
+    body_rows = _Cells.from_columns(texts, widths)
+
+    col_lens = body_rows.widths
+    header_rows = []
+    if header:
+        header_rows = _Cells([names])
+        col_lens = _merge_col_lens(header_rows.widths, col_lens)
+    return _render(_iter_table(header_rows, body_rows, col_lens, formats), out, encoding)
+
+def sprint_columns_as_text(columns, names=None, header=True, float_precision=DEFAULT_FLOAT_PRECISION):
+    return render_columns_as_text(columns, None, names, header, float_precision)
+
+def print_columns_as_text(columns, names=None, header=True, float_precision=DEFAULT_FLOAT_PRECISION):
+    render_columns_as_text(columns, sys.stdout, names, header, float_precision, locale.getpreferredencoding())
+
+class LiveTable(object):
+    """A table that rows are added to over time (e.g. monitoring output).  Each row
+       is written to out as it's appended, without going back over the earlier ones.
+
+       col_lens - starting column widths
+       grow     - if True, columns widen to fit wider rows, and the header is written
+                  again with the new widths; otherwise wider rows just stick out
+       tail     - if given, the last tail rows are kept, for render()
+       out      - where rows are written [stdout, in the preferred encoding]
+    """
+    def __init__(self, header=None, col_lens=None, formats=None, grow=True, tail=None, out=None, encoding=None):
+        self.formats = formats
+        self.raw = bool(formats)
+        self.grow = grow or not col_lens
+        self.col_lens = list(col_lens or [])
+        if header is None:
+            self.header_rows = []
+        else:
+            self.header_rows = _Cells([header], self.raw)
+            if self.grow:
+                self.col_lens = _merge_col_lens(self.col_lens, self.header_rows.widths)
+        self.rows = collections.deque(maxlen=tail) if tail else None
+        if out is None:
+            out = sys.stdout
+            encoding = encoding or locale.getpreferredencoding()
+        self.out = out
+        self.encoding = encoding
+        self.fmt = None
+
+    def append(self, row):
+        cells = _Cells([row], self.raw)
+        if self.grow:
+            col_lens = _merge_col_lens(self.col_lens, cells.widths)
+            if col_lens!=self.col_lens:
+                self.col_lens = col_lens
+                self.fmt = None
+        if self.fmt is None:
+            # -- First row, or the widths changed: (re)write the header
+            self.fmt = _make_fmt(self.col_lens, self.formats)
+            lines = list(_iter_table(self.header_rows, [], self.col_lens, self.formats))
+        else:
+            lines = []
+        lines.extend(_format_rows(cells, self.fmt, self.col_lens, self.formats))
+        if self.rows is not None:
+            self.rows.extend(cells)
+        _render(iter(lines), self.out, self.encoding)
+        self.out.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def render(self):
+        """The header and the kept tail rows as one unicode string"""
+        return u"".join(_iter_table(self.header_rows, self.rows or [], self.col_lens, self.formats))
@@ -1,17 +1,49 @@
-import time
+import os
+import re
 import sys
+import time
+import tempfile
+import threading
 import StringIO
+import collections
 import makeutf8
 
+_BACKSPACES = re.compile("\b+")
+
+def _locked(lock, method):
+    def locked(*args):
+        with lock:
+            return method(*args)
+    return locked
+
 class StdFile(StringIO.StringIO):
-    """A cStringIO sub-class that provides a fileno so things that check the fileno
-       of stdin/out/err don't get cranky
+    """A StringIO sub-class that provides a fileno so things that check the fileno
+       of stdin/out/err don't get cranky.  What's written is kept as a list of chunks,
+       only joined by getvalue() (reading only sees the initial text, e.g. stdin's)
+
+       max_bytes, max_lines - keep only the last max_bytes characters / max_lines lines
+                              (plus any line still being written)
+       spill_size - once more than spill_size characters are written, move them to a
+                    temporary file (unicode is written as utf-8), see captured()
     """
     
-    def __init__(self, fileno, *args, **kwargs):
+    def __init__(self, fileno, buf='', max_bytes=None, max_lines=None, spill_size=None):
+        if spill_size is not None and (max_bytes or max_lines):
+            raise ValueError, "Use either max_bytes/max_lines or spill_size, not both"
         self._fileno = fileno
         self._passthru = None
-        StringIO.StringIO.__init__(self, *args, **kwargs)
+        self._chunks = collections.deque()
+        self._chunk_lines = collections.deque()     # newlines in each chunk, when limited
+        self._limited = bool(max_bytes or max_lines or spill_size is not None)
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.spill_size = spill_size
+        self._size = 0
+        self._lines = 0
+        self._spill_path = None
+        self._spill_file = None
+        self._threadsafe = False
+        StringIO.StringIO.__init__(self, buf)
     
     def fileno(self):
         return self._fileno
@@ -23,16 +55,232 @@ class StdFile(StringIO.StringIO):
         if self._passthru:
             self._passthru.write(s)
         if "\b" in s:
-            while "\b\b" in s:
-                s = s.replace("\b\b", "\b")
-            s = s.replace("\b", "\n")
-        StringIO.StringIO.write(self, s)
+            s = _BACKSPACES.sub("\n", s)
+        if self._spill_file is None:
+            self._chunks.append(s)
+            if self._limited:
+                self._limit(s)
+        else:
+            self._spill_file.write(s.encode('utf-8') if isinstance(s, unicode) else s)
+
+    def _limit(self, s):
+        self._size += len(s)
+        if self.spill_size is not None:
+            if self._size>self.spill_size:
+                self._start_spill()
+            return
+        # -- Drop whole chunks from the front while what's left is still enough;
+        #    getvalue() trims the rest.  Each chunk's newlines are only counted once
+        nlines = s.count("\n")
+        self._lines += nlines
+        self._chunk_lines.append(nlines)
+        chunks = self._chunks
+        chunk_lines = self._chunk_lines
+        while len(chunks)>1:
+            first = chunks[0]
+            first_lines = chunk_lines[0]
+            if ((self.max_bytes and self._size-len(first)>=self.max_bytes) or
+                (self.max_lines and self._lines-first_lines>=self.max_lines)):
+                chunks.popleft()
+                chunk_lines.popleft()
+                self._size -= len(first)
+                self._lines -= first_lines
+            else:
+                break
+
+    def _start_spill(self):
+        fd, self._spill_path = tempfile.mkstemp(prefix="stdwrapper-")
+        self._spill_file = os.fdopen(fd, 'wb')
+        for chunk in self._chunks:
+            self._spill_file.write(chunk.encode('utf-8') if isinstance(chunk, unicode) else chunk)
+        self._chunks.clear()
+        self._chunk_lines.clear()
+
+    def getvalue(self):
+        if self._spill_file is not None:
+            f = self.captured()
+            try:
+                return f.read()
+            finally:
+                f.close()
+        chunks = self._chunks
+        if len(chunks)>1:
+            # -- Kept joined, so calling getvalue() again doesn't redo it
+            joined = "".join(chunks)
+            chunks.clear()
+            chunks.append(joined)
+            if self._chunk_lines:
+                self._chunk_lines.clear()
+                self._chunk_lines.append(self._lines)
+        value = StringIO.StringIO.getvalue(self)
+        if chunks:
+            value += chunks[0]
+        if self.max_bytes:
+            value = value[-self.max_bytes:]
+        if self.max_lines and value.count("\n")>self.max_lines:
+            # -- Everything after the last max_lines+1'th newline from the end
+            value = value[len(value.rsplit("\n", self.max_lines+1)[0])+1:]
+        return value
+
+    def make_threadsafe(self):
+        """For when another thread writes too (StdWrapper's fd capture and progress): writes
+           and reads take a lock.  Done per instance, so the usual path doesn't pay for it
+        """
+        if self._threadsafe:
+            return
+        self._threadsafe = True
+        lock = threading.RLock()
+        for name in ('write', 'getvalue', 'captured'):
+            setattr(self, name, _locked(lock, getattr(self, name)))
+
+    def captured(self):
+        """getvalue(), or once it's spilled, a file to read the output from"""
+        if self._spill_file is None:
+            return self.getvalue()
+        self._spill_file.flush()
+        return open(self._spill_path, 'rb')
+
+    def end_spill(self):
+        """Done writing: the temporary file goes away once files from captured() are closed"""
+        if self._spill_file is not None and not self._spill_file.closed:
+            self._spill_file.close()
+            try:
+                os.remove(self._spill_path)
+            except OSError:
+                # -- e.g. Windows, while it's still open
+                pass
 
 class StdFileUnicode(StdFile):
     def write(self, s):
         return StdFile.write(self, makeutf8.make_unicode(s))
 
+class ThreadDispatch(object):
+    """Stands in for sys.stdout/stderr/stdin, passing everything on to the file the
+       current thread has set, or else the file it replaced.  Used by StdWrapper's
+       thread_local mode, so threads can each capture their own output at once.
+    """
+    def __init__(self, fallback):
+        self._fallback = fallback
+        self._local = threading.local()
+        self._users = 0     # captures using it, kept by _acquire/_release_dispatcher
+
+    def current(self):
+        target = getattr(self._local, 'target', None)
+        if target is None:
+            return self._fallback
+        return target
+
+    def set_target(self, f):
+        """Sends this thread's calls to f (None for the replaced file).  Returns what was set before"""
+        previous = getattr(self._local, 'target', None)
+        self._local.target = f
+        return previous
+
+    def write(self, s):
+        self.current().write(s)
+
+    # -- print keeps its trailing comma state on the file, so keep it on the target
+    softspace = property(lambda self: self.current().softspace,
+                         lambda self, value: setattr(self.current(), 'softspace', value))
+
+    # -- Special methods are looked up on the type, so __getattr__ doesn't see them
+    def __iter__(self):
+        return iter(self.current())
+
+    def next(self):
+        return self.current().next()
+
+    def __enter__(self):
+        return self.current().__enter__()
+
+    def __exit__(self, *args):
+        return self.current().__exit__(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.current(), name)
+
+# -- {"stdout"/"stderr"/"stdin": the ThreadDispatch that's in place}
+_DISPATCHERS = {}
+_DISPATCHERS_LOCK = threading.Lock()
+
+def _acquire_dispatcher(name):
+    with _DISPATCHERS_LOCK:
+        dispatcher = _DISPATCHERS.get(name)
+        if dispatcher is None or getattr(sys, name) is not dispatcher:
+            dispatcher = _DISPATCHERS[name] = ThreadDispatch(getattr(sys, name))
+            setattr(sys, name, dispatcher)
+        dispatcher._users += 1
+        return dispatcher
+
+def _release_dispatcher(name, dispatcher):
+    with _DISPATCHERS_LOCK:
+        dispatcher._users -= 1
+        if not dispatcher._users:
+            if _DISPATCHERS.get(name) is dispatcher:
+                del _DISPATCHERS[name]
+            if getattr(sys, name) is dispatcher:
+                setattr(sys, name, dispatcher._fallback)
+
+def _unused_dispatchers_removed(f):
+    # -- A wrapper put in place while a thread_local capture was going can be done after
+    #    it; the ThreadDispatch it then puts back isn't needed any more
+    with _DISPATCHERS_LOCK:
+        while isinstance(f, ThreadDispatch) and not f._users:
+            f = f._fallback
+        return f
+
+FD_READ_SIZE = 64*1024
+FD_DRAIN_TIMEOUT = 5.0 # seconds
+
+def _flush_c_stdio():
+    # -- So what C code has printf'ed but not flushed yet goes where it's meant to
+    try:
+        import ctypes
+        ctypes.CDLL(None).fflush(None)
+    except (ImportError, OSError, TypeError, AttributeError):
+        pass
+
+class _FdCapture(object):
+    """Points a file descriptor at a pipe, with a thread that reads everything written
+       to it into target (so writers never block on a full pipe), until restore()
+    """
+    def __init__(self, fd, target):
+        self.fd = fd
+        self.saved_fd = os.dup(fd)
+        read_fd, write_fd = os.pipe()
+        os.dup2(write_fd, fd)
+        os.close(write_fd)
+        self.thread = threading.Thread(target=self._drain, args=(read_fd, target))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _drain(self, read_fd, target):
+        try:
+            while True:
+                data = os.read(read_fd, FD_READ_SIZE)
+                if not data:
+                    break
+                target.write(data)
+        finally:
+            os.close(read_fd)
+
+    def original_file(self):
+        """A file that writes to where fd used to go"""
+        return os.fdopen(os.dup(self.saved_fd), 'w', 0)
+
+    def restore(self):
+        os.dup2(self.saved_fd, self.fd)
+        os.close(self.saved_fd)
+        # -- The pipe only closes once child processes that have it are done too
+        self.thread.join(FD_DRAIN_TIMEOUT)
+
 DEFAULT_PROGRESS_INTERVAL = 1.0 # seconds        
+PROGRESS_POLL_INTERVAL = 0.05 # seconds
+
+# -- A clock that doesn't jump when the system time is set.  os.times()[4] is the
+#    elapsed real time, for pythons without time.monotonic
+_monotonic = getattr(time, 'monotonic', None) or (lambda: os.times()[4])
+
 class StdWrapper:
     """
         Example:
@@ -54,15 +302,32 @@ class StdWrapper:
                  inputFile=None, combine_stdout_and_stderr=False, passthru=False,
                  progress_interval=DEFAULT_PROGRESS_INTERVAL,
                  passthru_stderr=False,
-                 unicode_out=False):
+                 unicode_out=False,
+                 max_bytes=None, max_lines=None, spill_size=None,
+                 thread_local=False, capture_fds=False):
         """
         wrapOutput    - If False, then stdout and stderr are not affected
         inputText     - If has a value, then stdin is replaced with a StdFile containing that text
         inputFile     - If has a value, then stdin in replaced with that file, opened [ignored if inputText is set]
         combine_stdout_and_stderr - If True, then only one file is StdFile is used.  This can cause programs that check for fileno 2 to get confused
         passthru      - If True, then not only capture the output, but also write it to the original file location (good for debugging)
+        max_bytes, max_lines - If set, only the last max_bytes characters/max_lines lines of each output are kept
+        spill_size    - If set, output past spill_size characters is kept in a temporary file, and
+                        get()/done() return a file to read it from rather than a string
+        thread_local  - If True, only this thread's output is captured (and its input replaced), so other
+                        threads can capture at the same time.  done() has to be called from the same thread
+        capture_fds   - If True, file descriptors 1 and 2 are captured too, so output from C code and child
+                        processes is caught.  It's read in as it comes, so it's interleaved with
+                        python's output only roughly
         """
-        StdWrapper.wrapDepth += 1
+        if inputText and inputFile:
+            raise ValueError, "Only one of inputText and inputFile can be used"
+        if thread_local and capture_fds:
+            raise ValueError, "File descriptors can't be captured per thread"
+        self.thread_local = thread_local
+        self._dispatched = []
+        if not thread_local:
+            StdWrapper.wrapDepth += 1
 
         self.passthru = passthru
         self.passthru_stderr = passthru_stderr
@@ -75,79 +340,128 @@ class StdWrapper:
             _stdFileClass = StdFile
                     
         #print "StdWrapper.__init__ - depth:", wrapDepth
-        self.tmpstdout = _stdFileClass(1)
+        limits = dict(max_bytes=max_bytes, max_lines=max_lines, spill_size=spill_size)
+        self.tmpstdout = _stdFileClass(1, **limits)
         if combine_stdout_and_stderr:
             self.tmpstderr = self.tmpstdout
         else:
-            self.tmpstderr = _stdFileClass(2)      
+            self.tmpstderr = _stdFileClass(2, **limits)      
 
         self.oldstdout = sys.stdout
         self.oldstderr = sys.stderr
+        # -- Where passthru output and live progress go
+        self.realstdout = self.oldstdout
+        self.realstderr = self.oldstderr
         
+        self._fd_captures = []
+        if wrapOutput and capture_fds:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            _flush_c_stdio()
+            self.tmpstdout.make_threadsafe()
+            if not combine_stdout_and_stderr:
+                self.tmpstderr.make_threadsafe()
+            self._fd_captures = [_FdCapture(1, self.tmpstdout), _FdCapture(2, self.tmpstderr)]
+            # -- sys.stdout/err write to fds 1 and 2, which are the pipes now
+            self.realstdout = self._fd_captures[0].original_file()
+            self.realstderr = self._fd_captures[1].original_file()
+
         if wrapOutput:
-            sys.stdout = self.tmpstdout
-            sys.stderr = self.tmpstderr
+            self.oldstdout = self._swap('stdout', self.tmpstdout)
+            self.oldstderr = self._swap('stderr', self.tmpstderr)
+            if not self._fd_captures:
+                # -- Not sys.stdout from above, which can be a ThreadDispatch that'd send
+                #    passthru output straight back here
+                self.realstdout = self.oldstdout
+                self.realstderr = self.oldstderr
             if passthru:
-                self.tmpstdout.enable_passthru(self.oldstdout)
+                self.tmpstdout.enable_passthru(self.realstdout)
             if not combine_stdout_and_stderr and (passthru or passthru_stderr):
-                self.tmpstderr.enable_passthru(self.oldstderr)
+                self.tmpstderr.enable_passthru(self.realstderr)
                     
 
         self.oldstdin = sys.stdin
         if inputText:
-            if inputFile:
-                raise ValueError, "Only one of inputText and inputFile can be used"
             self.tmpstdin = StdFile(0, inputText)
-            sys.stdin = self.tmpstdin
+            self.oldstdin = self._swap('stdin', self.tmpstdin)
         elif inputFile:
             self.tmpstdin = None
-            sys.stdin = inputFile            
+            self.oldstdin = self._swap('stdin', inputFile)
         else:
             self.tmpstdin = None
 
         self.progress_line_buffer = ""
         self.next_progress_time = 0.0
         self.live_progress = self.passthru or self.wrapOutput
+        # -- progress() just leaves these for the renderer thread
+        self._progress_lines = collections.deque()  # finished lines, not drawn yet
+        self._progress_line = None                  # the latest unfinished line
+        self._drawn_line = None
+        self._renderer = None
+        self._renderer_stop = False
     
+    def _swap(self, name, f):
+        # -- Puts f in place of sys.<name>, for this thread if thread_local.  Returns the file it replaces
+        if not self.thread_local:
+            old = getattr(sys, name)
+            setattr(sys, name, f)
+            return old
+        dispatcher = _acquire_dispatcher(name)
+        old = dispatcher.current()
+        self._dispatched.append((name, dispatcher, dispatcher.set_target(f)))
+        return old
+
     def get(self):
         # Get the current values w/o disturbing things
-        out = self.tmpstdout.getvalue()
-        err = self.tmpstderr.getvalue()
+        out = self.tmpstdout.captured()
+        err = self.tmpstderr.captured()
         return out, err
     
     def done(self):
-        sys.stdout = self.oldstdout
-        sys.stderr = self.oldstderr
-        sys.stdin = self.oldstdin
+        self._stop_renderer()
+        if self._fd_captures:
+            _flush_c_stdio()
+            for fd_capture in reversed(self._fd_captures):
+                fd_capture.restore()
+            self._fd_captures = []
+            self.realstdout.close()
+            self.realstderr.close()
+            self.realstdout = self.oldstdout
+            self.realstderr = self.oldstderr
+        if self.thread_local:
+            for name, dispatcher, previous in reversed(self._dispatched):
+                dispatcher.set_target(previous)
+                _release_dispatcher(name, dispatcher)
+            self._dispatched = []
+        else:
+            sys.stdout = _unused_dispatchers_removed(self.oldstdout)
+            sys.stderr = _unused_dispatchers_removed(self.oldstderr)
+            sys.stdin = _unused_dispatchers_removed(self.oldstdin)
         
-        #print "StdWrapper.done - depth:", wrapDepth
-        StdWrapper.wrapDepth -= 1
-        out = self.tmpstdout.getvalue()
-        err = self.tmpstderr.getvalue()
+            #print "StdWrapper.done - depth:", wrapDepth
+            StdWrapper.wrapDepth -= 1
+        out = self.tmpstdout.captured()
+        err = self.tmpstderr.captured()
+        self.tmpstdout.end_spill()
+        self.tmpstderr.end_spill()
         return out,err
     
     def isprogresstime(self):
-        return time.time()>self.next_progress_time
+        # -- progress() throttles itself now, so callers don't have to check this
+        return _monotonic()>self.next_progress_time
     
     def _write_live_progress_line(self, line, lf):        
         pb_len = len(self.progress_line_buffer)
         if pb_len:
-            # Determine how much of progress_line_buffer is the same as the line to print
-            idx = 0
-            for b, c in map(None, self.progress_line_buffer, line):
-                if b!=c:
-                    break
-                idx += 1
-            assert(pb_len>=idx)
-            num_back = pb_len - idx
-            
-            self.oldstderr.write("\b" * num_back)
-            self.oldstderr.write(line[idx:])
+            # Only redraw from where line differs from progress_line_buffer
+            idx = len(os.path.commonprefix([self.progress_line_buffer, line]))
+            self.realstderr.write("\b" * (pb_len-idx))
+            self.realstderr.write(line[idx:])
         else:
-            self.oldstderr.write(line)
+            self.realstderr.write(line)
             
         if lf:
-            self.oldstderr.write("\n")
+            self.realstderr.write("\n")
             self.progress_line_buffer = ""
         else:
             self.progress_line_buffer = line
@@ -156,12 +470,56 @@ class StdWrapper:
         if self.live_progress:
             self._write_live_progress_line(line, lf)
         if self.wrapOutput:
-            sys.stderr.write("%s\n" % line)
+            # -- Not sys.stderr: this runs on the renderer thread
+            self.tmpstderr.write("%s\n" % line)
 
     def progress(self, msg):
-        lines = msg.split("\n")
-        for line in lines[:-1]:
-            self.__write_progress_line(line, True)
-        for line in lines[-1:]:
-            self._write_progress_line(line, False)        
-        self.next_progress_time = time.time()+self.progress_interval
+        """Shows msg as the progress line (lines before a newline in it are finished, and
+           stay).  Only keeps it: a renderer thread draws the latest message at most once
+           per progress_interval, so it's fine to call as often as you like
+        """
+        if "\n" in msg:
+            lines = msg.split("\n")
+            self._progress_lines.extend(lines[:-1])
+            msg = lines[-1]
+        self._progress_line = msg
+        if self._renderer_stop:
+            # -- After done(): no renderer thread any more, so draw it here
+            self._draw_progress()
+        elif self._renderer is None:
+            self._start_renderer()
+
+    def _start_renderer(self):
+        if self.wrapOutput:
+            self.tmpstderr.make_threadsafe()
+        self._renderer = threading.Thread(target=self._render_progress)
+        self._renderer.daemon = True
+        self._renderer.start()
+
+    def _render_progress(self):
+        while not self._renderer_stop:
+            self._draw_progress()
+            self.next_progress_time = _monotonic()+self.progress_interval
+            while not self._renderer_stop:
+                remaining = self.next_progress_time-_monotonic()
+                if remaining<=0:
+                    break
+                time.sleep(min(remaining, PROGRESS_POLL_INTERVAL))
+
+    def _draw_progress(self):
+        lines = self._progress_lines
+        while lines:
+            self._write_progress_line(lines.popleft(), True)
+            self._drawn_line = None
+        line = self._progress_line
+        if line is not None and line!=self._drawn_line:
+            self._write_progress_line(line, False)
+            self._drawn_line = line
+
+    def _stop_renderer(self):
+        self._renderer_stop = True
+        if self._renderer is not None:
+            self._renderer.join()
+            self._renderer = None
+            # -- Whatever came in since the last redraw
+            self._draw_progress()
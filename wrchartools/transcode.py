@@ -0,0 +1,175 @@
+#
+# transcode -- convert files/directories of mixed-encoding text files to utf-8
+#
+#   wr-transcode [options] SOURCE DEST
+#
+
+import os
+import sys
+import mmap
+import time
+import optparse
+import itertools
+import multiprocessing
+import makeutf8
+
+WRITE_BUFFER_SIZE = 1024*1024
+
+def _makedirs(path):
+    dir_name = os.path.dirname(path)
+    if dir_name and not os.path.isdir(dir_name):
+        try:
+            os.makedirs(dir_name)
+        except OSError:
+            # -- Another worker got there first
+            if not os.path.isdir(dir_name):
+                raise
+
+def transcode_file(in_path, out_path, charsets=None, chunk_size=makeutf8.DEFAULT_CHUNK_SIZE):
+    """Converts in_path to utf-8 in out_path.  Returns (size, charset, fallbacks)"""
+    size = os.path.getsize(in_path)
+    _makedirs(out_path)
+    decoder = makeutf8.IncrementalCharsetDecoder(charsets)
+    with open(in_path, 'rb') as fin:
+        with open(out_path, 'wb', WRITE_BUFFER_SIZE) as fout:
+            if size:
+                # -- Can't mmap an empty file
+                mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for start in xrange(0, size, chunk_size):
+                        fout.write(decoder.decode(mm[start:start+chunk_size]).encode('utf-8'))
+                finally:
+                    mm.close()
+            fout.write(decoder.decode('', True).encode('utf-8'))
+    return size, decoder.charset, decoder.fallbacks
+
+def repair_file(in_path, out_path, charsets=None, chunk_size=makeutf8.DEFAULT_CHUNK_SIZE):
+    """Copies in_path to out_path, decoding only the byte ranges that aren't valid utf-8.
+       For files that mix utf-8 lines with lines in other charsets.  Returns (size, charset, repairs)
+    """
+    size = os.path.getsize(in_path)
+    _makedirs(out_path)
+    repair_charsets = makeutf8._repair_charsets(charsets)
+    repairs = 0
+    with open(in_path, 'rb') as fin:
+        with open(out_path, 'wb', WRITE_BUFFER_SIZE) as fout:
+            if size:
+                mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for start, end, is_valid in makeutf8._utf8_ranges(mm, chunk_size):
+                        if is_valid:
+                            fout.write(buffer(mm, start, end-start))
+                        else:
+                            fout.write(makeutf8.makeUTF8(mm[start:end], repair_charsets))
+                            repairs += 1
+                finally:
+                    mm.close()
+    return size, 'utf-8', repairs
+
+def _transcode_job(args):
+    in_path, out_path, charsets, chunk_size, repair = args
+    if repair:
+        func = repair_file
+    else:
+        func = transcode_file
+    try:
+        return (in_path,) + func(in_path, out_path, charsets, chunk_size) + (None,)
+    except (IOError, OSError, UnicodeDecodeError), e:
+        return in_path, 0, None, 0, "%s: %s" % (e.__class__.__name__, e)
+
+def _iter_paths(source, dest):
+    if not os.path.isdir(source):
+        yield source, dest
+        return
+    for dir_path, dir_names, file_names in os.walk(source):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            in_path = os.path.join(dir_path, file_name)
+            yield in_path, os.path.join(dest, os.path.relpath(in_path, source))
+
+class TranscodeStats(object):
+    def __init__(self, charsets=None):
+        self.first_charset = (charsets or makeutf8.DEFAULT_CHARSETS)[0]
+        self.files = 0
+        self.bytes = 0
+        self.charsets = {}
+        self.other_charset = 0
+        self.fallbacks = 0
+        self.errors = []
+        self.start = time.time()
+        self.seconds = 0.0
+
+    def add(self, in_path, size, charset, fallbacks, error):
+        if error:
+            self.errors.append((in_path, error))
+            return
+        self.files += 1
+        self.bytes += size
+        if charset:
+            self.charsets[charset] = self.charsets.get(charset, 0) + 1
+            if charset!=self.first_charset:
+                self.other_charset += 1
+        self.fallbacks += fallbacks
+
+    def done(self):
+        self.seconds = time.time()-self.start
+
+    def summary(self):
+        secs = max(self.seconds, 1e-6)
+        mb = self.bytes/(1024.0*1024.0)
+        lines = ["%s files, %.1f MB in %.2fs: %.1f files/s, %.2f MB/s" % (self.files, mb, self.seconds, self.files/secs, mb/secs),
+                 "%s files not %s, %s fallbacks/repairs part way through a file" % (self.other_charset, self.first_charset, self.fallbacks)]
+        for charset, count in sorted(self.charsets.items()):
+            lines.append("  %-12s %s" % (charset, count))
+        for in_path, error in self.errors:
+            lines.append("ERROR %s: %s" % (in_path, error))
+        return "\n".join(lines)
+
+def transcode_tree(source, dest, charsets=None, jobs=None, chunk_size=makeutf8.DEFAULT_CHUNK_SIZE, repair=False):
+    """Converts source (a file or a directory tree) into dest.  Returns a TranscodeStats
+       repair - use repair_file() rather than transcode_file()
+    """
+    stats = TranscodeStats(charsets)
+    work = ((in_path, out_path, charsets, chunk_size, repair) for in_path, out_path in _iter_paths(source, dest))
+    if jobs==1:
+        for result in itertools.imap(_transcode_job, work):
+            stats.add(*result)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for result in pool.imap_unordered(_transcode_job, work, 4):
+                stats.add(*result)
+        finally:
+            pool.close()
+            pool.join()
+    stats.done()
+    return stats
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options] SOURCE DEST",
+                                   description="Convert a file, or a directory of files, in mixed encodings to utf-8")
+    parser.add_option("-c", "--charsets", default=",".join(makeutf8.DEFAULT_CHARSETS),
+                      help="comma separated charsets to try, in order [%default]")
+    parser.add_option("-j", "--jobs", type="int", default=None,
+                      help="number of worker processes [one per cpu]")
+    parser.add_option("--chunk-size", type="int", default=makeutf8.DEFAULT_CHUNK_SIZE,
+                      help="bytes decoded at a time [%default]")
+    parser.add_option("-r", "--repair", action="store_true", default=False,
+                      help="keep valid utf-8 as is and only decode the byte ranges that aren't (for files that mix charsets)")
+    parser.add_option("-q", "--quiet", action="store_true", default=False,
+                      help="don't print the summary")
+    options, args = parser.parse_args(argv)
+    if len(args)!=2:
+        parser.error("SOURCE and DEST are required")
+    source, dest = args
+    if os.path.isdir(source) and os.path.abspath(dest).startswith(os.path.abspath(source)+os.sep):
+        parser.error("DEST can't be inside SOURCE")
+
+    charsets = [c.strip() for c in options.charsets.split(",") if c.strip()]
+    stats = transcode_tree(source, dest, charsets, options.jobs, options.chunk_size, options.repair)
+    if not options.quiet or stats.errors:
+        print stats.summary()
+    return 1 if stats.errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())